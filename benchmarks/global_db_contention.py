@@ -0,0 +1,158 @@
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+from record_keeper import RecordWriter
+from record_keeper.db_utils import DBManager
+from record_keeper.sharded_db import ShardedDBManager
+
+
+def get_global_db_shards(shards):
+    # the RecordWriter argument
+    if shards in ["none", "experiment"]:
+        return None if shards == "none" else shards
+    return int(shards)
+
+
+def open_global_db(global_db_path, shards, **kwargs):
+    if shards == "none":
+        return DBManager(global_db_path, **kwargs)
+    kwargs.pop("is_global", None)
+    num_shards = get_global_db_shards(shards)
+    if num_shards == "experiment":
+        num_shards = None
+    return ShardedDBManager(global_db_path, num_shards, **kwargs)
+
+
+def writer(folder, global_db_path, experiment_name, pragmas, shards, args, start_event):
+    record_writer = RecordWriter(
+        folder=folder,
+        global_db_path=global_db_path,
+        experiment_name=experiment_name,
+        persistent_connections=True,
+        pragmas=pragmas,
+        global_db_shards=get_global_db_shards(shards),
+    )
+    start_event.wait()
+    iteration = 0
+    for _ in range(args.num_flushes):
+        for _ in range(args.iterations_per_flush):
+            for g in range(args.num_groups):
+                for s in range(args.num_series):
+                    record_writer.append(f"group{g}", f"series{s}", 0.5, iteration)
+            iteration += 1
+        record_writer.save_records()
+    record_writer.close()
+
+
+def reader(global_db_path, pragmas, shards, stop_event, start_event, latencies):
+    db = open_global_db(global_db_path, shards, persistent=True, pragmas=pragmas)
+    start_event.wait()
+    while not stop_event.is_set():
+        if db.table_exists("group0"):
+            s = time.perf_counter()
+            db.query("SELECT count(*) FROM group0")
+            latencies.append(time.perf_counter() - s)
+        time.sleep(0.01)
+    db.close()
+
+
+def run(profile, shards, args):
+    root = tempfile.mkdtemp()
+    global_db_path = os.path.join(root, "global.db" if shards == "none" else "global")
+    pragmas = None if profile == "default" else profile
+    # create the db and set the journal mode before the writers start
+    open_global_db(global_db_path, shards, is_global=True, pragmas=pragmas).close()
+
+    start_event = multiprocessing.Event()
+    stop_event = multiprocessing.Event()
+    manager = multiprocessing.Manager()
+    latencies = manager.list()
+    writers = [
+        multiprocessing.Process(
+            target=writer,
+            args=(
+                os.path.join(root, f"exp{i}"),
+                global_db_path,
+                f"exp{i}",
+                pragmas,
+                shards,
+                args,
+                start_event,
+            ),
+        )
+        for i in range(args.num_processes)
+    ]
+    readers = [
+        multiprocessing.Process(
+            target=reader,
+            args=(global_db_path, pragmas, shards, stop_event, start_event, latencies),
+        )
+        for _ in range(args.num_readers)
+    ]
+    for p in writers + readers:
+        p.start()
+    time.sleep(1)
+    s = time.perf_counter()
+    start_event.set()
+    for p in writers:
+        p.join()
+    elapsed = time.perf_counter() - s
+    stop_event.set()
+    for p in readers:
+        p.join()
+
+    latencies = sorted(latencies)
+    shutil.rmtree(root)
+    return {
+        "profile": profile,
+        "shards": shards,
+        "writer_seconds": elapsed,
+        "rows_per_second": args.num_processes
+        * args.num_flushes
+        * args.iterations_per_flush
+        * args.num_groups
+        / elapsed,
+        "reader_queries": len(latencies),
+        "reader_p50_ms": latencies[len(latencies) // 2] * 1000 if latencies else None,
+        "reader_max_ms": latencies[-1] * 1000 if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Many processes writing to one global db, with readers polling it"
+    )
+    parser.add_argument("--profiles", nargs="+", default=["default", "wal"])
+    # "none" is a single global db file, "experiment" is one file per experiment,
+    # and a number is that many files with experiments hashed into them
+    parser.add_argument("--shards", nargs="+", default=["none", "experiment"])
+    parser.add_argument("--num_processes", type=int, default=8)
+    parser.add_argument("--num_readers", type=int, default=2)
+    parser.add_argument("--num_flushes", type=int, default=20)
+    parser.add_argument("--iterations_per_flush", type=int, default=50)
+    parser.add_argument("--num_groups", type=int, default=10)
+    parser.add_argument("--num_series", type=int, default=5)
+    parser.add_argument("--output", type=str, default=None)
+    args = parser.parse_args()
+
+    results = [
+        run(profile, shards, args)
+        for profile in args.profiles
+        for shards in args.shards
+    ]
+    for r in results:
+        print(json.dumps(r))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+# Runs in a fresh interpreter each time, so nothing is already imported.
+SCRIPT = """
+import json, resource, sys, time
+sys.path.insert(0, %r)
+s = time.perf_counter()
+%s
+elapsed = time.perf_counter() - s
+print(json.dumps({
+    "seconds": elapsed,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "torch_loaded": "torch" in sys.modules,
+    "numpy_loaded": "numpy" in sys.modules,
+}))
+"""
+
+STATEMENTS = {
+    "record_keeper": "import record_keeper",
+    "record_keeper_query": (
+        "import tempfile, record_keeper\n"
+        "w = record_keeper.RecordWriter(tempfile.mkdtemp())\n"
+        "w.append('g', 'A', 1.5, 0)\n"
+        "w.save_records()\n"
+        "w.query('SELECT * FROM g', return_dict=True)"
+    ),
+    "torch": "import torch",
+}
+
+
+def measure(statement, repeats):
+    results = []
+    for _ in range(repeats):
+        output = subprocess.check_output(
+            [sys.executable, "-c", SCRIPT % (SRC, statement)], text=True
+        )
+        results.append(json.loads(output))
+    return {
+        "ms": statistics.median(x["seconds"] for x in results) * 1000,
+        "max_rss_mb": statistics.median(x["max_rss_mb"] for x in results),
+        "torch_loaded": results[0]["torch_loaded"],
+        "numpy_loaded": results[0]["numpy_loaded"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time to import record_keeper in a fresh process"
+    )
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", type=str, default=None)
+    args = parser.parse_args()
+
+    results = {k: measure(v, args.repeats) for k, v in STATEMENTS.items()}
+    for k, v in results.items():
+        print(k, json.dumps(v))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import global_db_contention
+import import_time
+
+import record_keeper
+from record_keeper import RecordKeeper, RecordWriter
+
+# Each scenario returns a dict of timings in milliseconds.
+# Scenarios are CPU only, and use fixed sizes so results are comparable
+# between commits. --scale shrinks or grows every size.
+
+
+class Wide(torch.nn.Module):
+    def __init__(self, num_attributes):
+        super().__init__()
+        self._record_these = [f"stat{i}" for i in range(num_attributes)]
+        for i in range(num_attributes):
+            setattr(self, f"stat{i}", float(i))
+
+
+class Deep(torch.nn.Module):
+    def __init__(self, depth):
+        super().__init__()
+        self._record_these = ["x", "y"]
+        self.x, self.y = 1.0, torch.tensor(2.0)
+        if depth > 0:
+            self.child = Deep(depth - 1)
+
+
+def scaled(x, args):
+    return max(1, int(x * args.scale))
+
+
+def time_update_records(models, folder, num_steps, recursive_types=None):
+    record_keeper = RecordKeeper(
+        record_writer=RecordWriter(folder),
+        attributes_to_search_for=["_record_these"],
+    )
+    s = time.perf_counter()
+    for i in range(num_steps):
+        record_keeper.update_records(models, i, recursive_types=recursive_types)
+    update_ms = (time.perf_counter() - s) * 1000
+    s = time.perf_counter()
+    record_keeper.save_records()
+    save_ms = (time.perf_counter() - s) * 1000
+    return {"update_records_ms": update_ms, "save_records_ms": save_ms}
+
+
+def wide_records(folder, args):
+    models = {f"model{i}": Wide(scaled(200, args)) for i in range(4)}
+    return time_update_records(models, folder, scaled(200, args))
+
+
+def deep_recursion(folder, args):
+    models = {"model": Deep(scaled(30, args))}
+    # submodules are in the _modules dict
+    return time_update_records(
+        models, folder, scaled(500, args), recursive_types=[torch.nn.Module, dict]
+    )
+
+
+def append_and_save(folder, args):
+    record_writer = RecordWriter(folder)
+    num_series, num_steps = scaled(50, args), scaled(2000, args)
+    s = time.perf_counter()
+    for i in range(num_steps):
+        for j in range(num_series):
+            record_writer.append("metrics", f"series{j}", i * 0.5, i)
+    append_ms = (time.perf_counter() - s) * 1000
+    s = time.perf_counter()
+    record_writer.save_records()
+    save_ms = (time.perf_counter() - s) * 1000
+    return {"append_ms": append_ms, "save_records_ms": save_ms}
+
+
+def growing_csv(folder, args):
+    # many small flushes, so the CSV and tables keep growing
+    record_writer = RecordWriter(folder)
+    num_flushes, iteration, flush_ms = scaled(200, args), 0, []
+    for _ in range(num_flushes):
+        for _ in range(10):
+            for j in range(10):
+                record_writer.append("metrics", f"series{j}", 1.0, iteration)
+            iteration += 1
+        s = time.perf_counter()
+        record_writer.save_records()
+        flush_ms.append((time.perf_counter() - s) * 1000)
+    n = max(1, num_flushes // 10)
+    return {
+        "total_ms": sum(flush_ms),
+        "first_flushes_ms": statistics.mean(flush_ms[:n]),
+        "last_flushes_ms": statistics.mean(flush_ms[-n:]),
+    }
+
+
+def query(folder, args):
+    record_writer = RecordWriter(folder)
+    num_rows = scaled(50000, args)
+    for i in range(num_rows):
+        record_writer.append("metrics", "A", i, i)
+        record_writer.append("metrics", "B", i * 0.5, i)
+    record_writer.save_records()
+    output = {}
+    for name, kwargs in [
+        ("query_ms", {"return_dict": True}),
+        ("query_numpy_ms", {"return_dict": True, "return_numpy": True}),
+    ]:
+        s = time.perf_counter()
+        record_writer.query("SELECT * FROM metrics", **kwargs)
+        output[name] = (time.perf_counter() - s) * 1000
+    s = time.perf_counter()
+    for i in range(100):
+        record_writer.select(
+            "metrics", ["A"], start_iteration=i * 100, end_iteration=i * 100 + 10
+        )
+    output["select_range_ms"] = (time.perf_counter() - s) * 1000
+    return output
+
+
+def list_series(folder, args):
+    output = {}
+    for list_format in ["json", "array"]:
+        subfolder = os.path.join(folder, list_format)
+        record_writer = RecordWriter(
+            subfolder, save_lists=True, list_format=list_format
+        )
+        s = time.perf_counter()
+        for i in range(scaled(1000, args)):
+            record_writer.append("metrics", "A", torch.rand(256), i)
+        record_writer.save_records()
+        output[f"{list_format}_write_ms"] = (time.perf_counter() - s) * 1000
+        s = time.perf_counter()
+        record_writer.query("SELECT * FROM metrics")
+        output[f"{list_format}_query_ms"] = (time.perf_counter() - s) * 1000
+    return output
+
+
+def global_db(folder, args):
+    contention_args = argparse.Namespace(
+        num_processes=4,
+        num_readers=1,
+        num_flushes=scaled(10, args),
+        iterations_per_flush=20,
+        num_groups=5,
+        num_series=5,
+    )
+    result = global_db_contention.run("wal", "none", contention_args)
+    return {"writer_ms": result["writer_seconds"] * 1000}
+
+
+def import_record_keeper(folder, args):
+    # in fresh processes, so this is the only scenario that sees import costs
+    return {
+        "%s_ms" % k: import_time.measure(import_time.STATEMENTS[k], 1)["ms"]
+        for k in ["record_keeper", "record_keeper_query"]
+    }
+
+
+SCENARIOS = {
+    "wide_records": wide_records,
+    "deep_recursion": deep_recursion,
+    "append_and_save": append_and_save,
+    "growing_csv": growing_csv,
+    "query": query,
+    "list_series": list_series,
+    "global_db": global_db,
+    "import_time": import_record_keeper,
+}
+
+
+def run_scenario(fn, args):
+    # the median of each timing over args.repeats runs
+    timings = []
+    for _ in range(args.repeats):
+        folder = tempfile.mkdtemp()
+        try:
+            timings.append(fn(folder, args))
+        finally:
+            shutil.rmtree(folder)
+    return {k: statistics.median(x[k] for x in timings) for k in timings[0]}
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    torch.manual_seed(0)
+    torch.set_num_threads(1)
+    results = {}
+    for name in args.scenarios:
+        results[name] = run_scenario(SCENARIOS[name], args)
+        print(name, json.dumps(results[name]))
+    output = {
+        "commit": get_commit(),
+        "version": record_keeper.__version__,
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "scale": args.scale,
+        "repeats": args.repeats,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+
+
+def compare(args):
+    # flags timings that got slower by more than args.threshold (a fraction)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    regressions = []
+    for name, timings in candidate["results"].items():
+        for k, v in timings.items():
+            old = baseline["results"].get(name, {}).get(k)
+            if old is None or old == 0:
+                continue
+            change = (v - old) / old
+            flag = ""
+            if change > args.threshold:
+                flag = "  REGRESSION"
+                regressions.append((name, k))
+            print(
+                "%s.%s: %.2f -> %.2f ms (%+.1f%%)%s"
+                % (name, k, old, v, change * 100, flag)
+            )
+    if len(regressions) > 0:
+        print(
+            "%d regression(s) above %.0f%%" % (len(regressions), args.threshold * 100)
+        )
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RecordKeeper benchmark suite")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run")
+    run_parser.add_argument(
+        "--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS)
+    )
+    run_parser.add_argument("--repeats", type=int, default=3)
+    run_parser.add_argument("--scale", type=float, default=1.0)
+    run_parser.add_argument("--output", type=str, default=None)
+
+    compare_parser = subparsers.add_parser("compare")
+    compare_parser.add_argument("baseline", type=str)
+    compare_parser.add_argument("candidate", type=str)
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+from record_keeper import RecordKeeper, RecordWriter
+
+
+class Module(torch.nn.Module):
+    def __init__(self, num_tensors, device):
+        super().__init__()
+        self._record_these = [f"stat{i}" for i in range(num_tensors)]
+        for i in range(num_tensors):
+            setattr(self, f"stat{i}", torch.rand((), device=device))
+
+
+def run(defer_tensor_conversion, args):
+    folder = tempfile.mkdtemp()
+    record_keeper = RecordKeeper(
+        record_writer=RecordWriter(folder),
+        attributes_to_search_for=["_record_these"],
+        defer_tensor_conversion=defer_tensor_conversion,
+    )
+    models = {
+        f"model{i}": Module(args.num_tensors, args.device)
+        for i in range(args.num_modules)
+    }
+    for i in range(args.warmup):
+        record_keeper.update_records(models, i)
+    s = time.perf_counter()
+    for i in range(args.num_steps):
+        record_keeper.update_records(models, i)
+    elapsed = time.perf_counter() - s
+    shutil.rmtree(folder)
+    return {
+        "defer_tensor_conversion": defer_tensor_conversion,
+        "device": args.device,
+        "ms_per_step": elapsed / args.num_steps * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="update_records with many tensor attributes per step"
+    )
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--num_modules", type=int, default=4)
+    parser.add_argument("--num_tensors", type=int, default=32)
+    parser.add_argument("--num_steps", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--output", type=str, default=None)
+    args = parser.parse_args()
+
+    results = [run(x, args) for x in [False, True]]
+    for r in results:
+        print(json.dumps(r))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
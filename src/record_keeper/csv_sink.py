@@ -0,0 +1,40 @@
+import csv
+import os
+
+from . import utils as c_f
+
+
+class CSVSink:
+    # Appends to one group's CSV file, keeping the file open and
+    # remembering the current header instead of re-reading the file.
+    def __init__(self, filename, buffer_size=65536):
+        self.filename = filename
+        self.buffer_size = buffer_size
+        self.header = None
+        self.file = None
+
+    def write(self, dict_of_lists):
+        # returns the number of bytes written
+        if self.file is None:
+            self.open()
+        start = self.file.tell()
+        writer = csv.writer(self.file)
+        header = list(dict_of_lists.keys())
+        if header != self.header:
+            writer.writerow(header)
+            self.header = header
+        writer.writerows(zip(*dict_of_lists.values()))
+        self.file.flush()
+        return self.file.tell() - start
+
+    def open(self):
+        if not os.path.isfile(self.filename):
+            self.header = None
+        elif self.header is None:
+            self.header = c_f.get_last_csv_header(self.filename)
+        self.file = open(self.filename, "a", buffering=self.buffer_size)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -1,6 +1,17 @@
+import collections
+import contextlib
 import datetime
 import json
+import os
 import sqlite3
+import struct
+import threading
+import time
+import zlib
+
+from . import rollups
+from . import utils as c_f
+from .stats import get_stats
 
 
 def adapt_list_to_JSON(lst):
@@ -11,14 +22,138 @@ def convert_JSON_to_list(data):
     return json.loads(data.decode("utf8"))
 
 
+# magic, is_compressed, ndim, len(dtype), followed by dtype, shape and data
+ARRAY_MAGIC = b"RKA1"
+ARRAY_HEADER = struct.Struct("<4sBBB")
+
+
+def adapt_array(a, compress=False):
+    import numpy as np
+
+    a = np.ascontiguousarray(a)
+    if a.dtype.hasobject:
+        raise TypeError("arrays of python objects can't be saved as bytes")
+    dtype = a.dtype.str.encode("ascii")
+    data = a.tobytes()
+    if compress:
+        data = zlib.compress(data)
+    return b"".join(
+        [
+            ARRAY_HEADER.pack(ARRAY_MAGIC, int(compress), a.ndim, len(dtype)),
+            dtype,
+            struct.pack("<%dq" % a.ndim, *a.shape),
+            data,
+        ]
+    )
+
+
+def convert_array(data):
+    import numpy as np
+
+    magic, compressed, ndim, dtype_len = ARRAY_HEADER.unpack_from(data)
+    if magic != ARRAY_MAGIC:
+        raise ValueError("not an array blob")
+    offset = ARRAY_HEADER.size
+    dtype = data[offset : offset + dtype_len].decode("ascii")
+    offset += dtype_len
+    shape = struct.unpack_from("<%dq" % ndim, data, offset)
+    offset += 8 * ndim
+    data = memoryview(data)[offset:]
+    if compressed:
+        data = zlib.decompress(data)
+    return np.frombuffer(data, dtype=dtype).reshape(shape)
+
+
 sqlite3.register_adapter(list, adapt_list_to_JSON)
+sqlite3.register_adapter(c_f.JSONList, lambda x: x.encode("utf8"))
 sqlite3.register_converter("json", convert_JSON_to_list)
+sqlite3.register_converter("array", convert_array)
+
+
+PRAGMA_PROFILES = {
+    "default": {},
+    # lets readers and writers proceed concurrently,
+    # for databases shared by many processes
+    "wal": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -64000,
+        "mmap_size": 268435456,
+        "busy_timeout": 60000,
+        "wal_autocheckpoint": 1000,
+    },
+    # for offline rebuilds, where a crash means starting over anyway
+    "bulk": {
+        "synchronous": "OFF",
+        "cache_size": -256000,
+        "temp_store": "MEMORY",
+    },
+}
+
+
+def get_pragmas(pragmas):
+    if pragmas is None:
+        return {}
+    if isinstance(pragmas, str):
+        return dict(PRAGMA_PROFILES[pragmas])
+    return dict(pragmas)
+
+
+def get_column_name(name, value):
+    if isinstance(value, (list, c_f.JSONList)):
+        return name + "_list"
+    elif c_f.is_array(value):
+        return name + "_array"
+    return name
+
+
+def get_column_type(value):
+    if isinstance(value, (list, c_f.JSONList)):
+        return "json"
+    elif c_f.is_array(value):
+        return "array"
+    elif isinstance(value, datetime.datetime):
+        return "timestamp"
+    elif isinstance(value, str):
+        return "text"
+    elif isinstance(value, int):
+        return "integer"
+    return "real"
 
 
 class DBManager:
-    def __init__(self, db_path, is_global=False):
+    def __init__(
+        self,
+        db_path,
+        is_global=False,
+        persistent=False,
+        pragmas=None,
+        checkpoint_interval=None,
+        create_indexes=True,
+        compress_arrays=False,
+        stats=None,
+        stats_name="db",
+        rollups=None,
+    ):
         self.db_path = db_path
         self.is_global = is_global
+        self.persistent = persistent
+        self.pragmas = get_pragmas(pragmas)
+        self.checkpoint_interval = checkpoint_interval
+        self.last_checkpoint = time.time()
+        self.schemas = {}
+        self.create_indexes = create_indexes
+        self.indexed_tables = set()
+        self.compress_arrays = compress_arrays
+        self.stats = get_stats(stats)
+        self.stats_name = stats_name
+        # bucket sizes of the rollup tables to update in write
+        self.rollups = sorted(rollups) if rollups else []
+        self.rollup_tables = set()
+        # (experiment_id, table_name) whose rollup coverage is up to date
+        self.rollup_coverage = set()
+        self.full_names = {}
+        self.reset_connections()
         if self.is_global:
             self.create_experiment_ids_table()
 
@@ -27,12 +162,13 @@ class DBManager:
             "CREATE TABLE IF NOT EXISTS experiment_ids (id integer primary key autoincrement, experiment_name text unique, has_records integer)"
         )
 
-    def new_experiment(self, experiment_name):
+    def new_experiment(self, experiment_name, experiment_id=None):
         if not self.experiment_name_has_records(experiment_name):
-            self.delete_experiment(experiment_name)
+            # removes any rows left by a run that crashed before flushing
+            self.purge_experiment(experiment_name)
         self.execute(
-            "INSERT INTO experiment_ids (experiment_name, has_records) values (?, ?)",
-            (experiment_name, int(False)),
+            "INSERT INTO experiment_ids (id, experiment_name, has_records) values (?, ?, ?)",
+            (experiment_id, experiment_name, int(False)),
         )
 
     def delete_experiment(self, experiment_name):
@@ -40,6 +176,86 @@ class DBManager:
             "DELETE FROM experiment_ids WHERE experiment_name=?", (experiment_name,)
         )
 
+    def purge_experiment(self, experiment_name):
+        # Deletes the experiment and its rows in every table. Foreign keys
+        # aren't enabled, so the ON DELETE CASCADE in the schema never runs.
+        num_rows = 0
+        with self.transaction():
+            output = self.execute(
+                "SELECT id FROM experiment_ids WHERE experiment_name=?",
+                (experiment_name,),
+                fetch=True,
+            )
+            if len(output) > 0:
+                experiment_id = output[0]["id"]
+                for table_name in self.get_experiment_tables():
+                    num_rows += (
+                        self.get_transaction()
+                        .execute(
+                            "DELETE FROM %s WHERE experiment_id=?" % table_name,
+                            (experiment_id,),
+                        )
+                        .rowcount
+                    )
+            self.delete_experiment(experiment_name)
+        self.rollup_coverage = set()
+        return num_rows
+
+    def purge_orphans(self):
+        # deletes rows whose experiment is no longer in experiment_ids
+        num_rows = 0
+        with self.transaction():
+            for table_name in self.get_experiment_tables():
+                num_rows += (
+                    self.get_transaction()
+                    .execute(
+                        "DELETE FROM %s WHERE experiment_id NOT IN (SELECT id FROM experiment_ids)"
+                        % table_name
+                    )
+                    .rowcount
+                )
+        return num_rows
+
+    def get_experiment_tables(self):
+        return [
+            x
+            for x in self.get_table_names(include_internal=True)
+            if "[experiment_id]" in self.get_schema(x, refresh=True)
+        ]
+
+    def compact(self, incremental=True):
+        # Returns the database size in bytes before and after.
+        # The first incremental compaction of a database switches it to
+        # auto_vacuum=INCREMENTAL, which needs one full VACUUM.
+        assert self.get_transaction() is None
+        conn = self.get_connection()
+        try:
+            before = self.get_size(conn)
+            auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+            if incremental and auto_vacuum == 2:
+                conn.execute("PRAGMA incremental_vacuum").fetchall()
+            else:
+                if incremental:
+                    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                conn.execute("VACUUM")
+            conn.execute("ANALYZE")
+            conn.commit()
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+            after = self.get_size(conn)
+        finally:
+            if not self.persistent:
+                conn.close()
+        return {
+            "bytes_before": before,
+            "bytes_after": after,
+            "bytes_reclaimed": before - after,
+        }
+
+    def get_size(self, conn):
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        return page_count * page_size
+
     def experiment_name_has_records(self, experiment_name):
         has_records = self.execute(
             "SELECT has_records FROM experiment_ids WHERE experiment_name=?",
@@ -58,88 +274,462 @@ class DBManager:
         )
         return output[0]["id"]
 
-    def write(self, table_name, dict_of_lists, experiment_name=None):
-        column_names_list = list(dict_of_lists.keys())
-        for i, x in enumerate(column_names_list):
-            if isinstance(dict_of_lists[x][0], list):
-                column_names_list[i] += "_list"
-            column_names_list[i] = "[{}]".format(column_names_list[i])
-
-        column_values, column_types_list = [], []
-
-        for i, x in enumerate(column_names_list):
-            curr_value = dict_of_lists[x.replace("[", "").replace("]", "")]
-            if isinstance(curr_value[0], list):
-                curr_type = "%s_list json" % x
-            elif isinstance(curr_value[0], datetime.datetime):
-                curr_type = "%s timestamp" % x
-            elif isinstance(curr_value[0], str):
-                curr_type = "%s text" % x
-            elif isinstance(curr_value[0], int):
-                curr_type = "%s integer" % x
-            else:
-                curr_type = "%s real" % x
-            column_values.append(curr_value)
-            column_types_list.append(curr_type)
+    def set_has_records(self, experiment_name):
+        self.execute(
+            "UPDATE experiment_ids SET has_records=? WHERE experiment_name=?",
+            (int(True), experiment_name),
+        )
 
-        column_types = ", ".join(column_types_list)
-        column_tuple = column_names_list
+    def write(
+        self, table_name, dict_of_lists, experiment_name=None, update_has_records=True
+    ):
+        column_names_list, column_values, column_types = [], [], {}
+        for k, v in dict_of_lists.items():
+            # the type comes from the first value that's set
+            first = next((y for y in v if y is not None), None)
+            if c_f.is_array(first) and c_f.has_object_arrays(v):
+                # saved as json instead
+                v = [y.tolist() if c_f.is_array(y) else y for y in v]
+                first = next((y for y in v if y is not None), None)
+            x = "[{}]".format(get_column_name(k, first))
+            column_types[x] = get_column_type(first)
+            if column_types[x] == "array":
+                v = [self.adapt_array(y) for y in v]
+            column_names_list.append(x)
+            column_values.append(v)
 
+        experiment_id = None
         if self.is_global:
             assert experiment_name is not None
-            column_tuple = ["experiment_id"] + column_tuple
-            column_types = (
-                "experiment_id integer, %s, FOREIGN KEY(experiment_id) REFERENCES experiment_ids(id) ON UPDATE CASCADE ON DELETE CASCADE"
-                % column_types
-            )
-            experiment_id = (self.get_experiment_id(experiment_name),) * len(
-                column_values[0]
-            )
-            column_values = [experiment_id] + column_values
+            column_names_list = ["experiment_id"] + column_names_list
+            experiment_id = self.get_experiment_id(experiment_name)
+            column_values = [(experiment_id,) * len(column_values[0])] + column_values
 
-        column_tuple = "({})".format(", ".join(str(x) for x in column_tuple))
+        column_tuple = "({})".format(", ".join(column_names_list))
         prepared_statement_filler = "(%s)" % (("?, " * len(column_values))[:-2])
         column_values = [x for x in zip(*column_values)]
+        insert = "INSERT INTO %s %s VALUES %s" % (
+            table_name,
+            column_tuple,
+            prepared_statement_filler,
+        )
+
+        self.stats.add("%s/rows" % self.stats_name, len(column_values))
+        with self.transaction() if len(self.rollups) > 0 else contextlib.nullcontext():
+            if "~iteration~" in dict_of_lists:
+                self.update_rollup_coverage(
+                    table_name, experiment_id, dict_of_lists["~iteration~"]
+                )
+            self.add_missing_columns(table_name, column_types)
+            try:
+                self.execute(insert, column_values, many=True)
+            except sqlite3.OperationalError:
+                # the cached schema is stale, e.g. the table was dropped
+                # or rolled back since it was loaded
+                self.schemas.pop(table_name, None)
+                self.add_missing_columns(table_name, column_types)
+                self.execute(insert, column_values, many=True)
+            if len(self.rollups) > 0 and "~iteration~" in dict_of_lists:
+                self.write_rollups(table_name, dict_of_lists, experiment_id)
+
+        if self.create_indexes and table_name not in self.indexed_tables:
+            self.create_index(table_name)
+
+        if self.is_global and update_has_records:
+            self.set_has_records(experiment_name)
+
+    def write_rollups(self, table_name, dict_of_lists, experiment_id=None):
+        with self.stats.time("%s/rollups" % self.stats_name):
+            all_aggregates = rollups.aggregate_all(dict_of_lists, self.rollups)
+            for bucket_size, aggregates in all_aggregates.items():
+                if len(aggregates) == 0:
+                    continue
+                if bucket_size not in self.rollup_tables:
+                    self.execute(rollups.get_create_query(bucket_size, self.is_global))
+                    self.rollup_tables.add(bucket_size)
+                self.execute(
+                    rollups.get_upsert_query(bucket_size, self.is_global),
+                    rollups.get_upsert_values(table_name, aggregates, experiment_id),
+                    many=True,
+                )
+
+    def update_rollup_coverage(self, table_name, experiment_id, iterations):
+        # Runs before a table's first write, and records from which iteration
+        # each rollup has every row of the experiment. Rollups that this
+        # DBManager doesn't update stop being complete, so they're dropped.
+        key = (experiment_id or 0, table_name)
+        if key in self.rollup_coverage:
+            return
+        self.rollup_coverage.add(key)
+        if len(self.rollups) == 0 and not self.table_exists(rollups.COVERAGE_TABLE):
+            return
+        self.execute(rollups.get_coverage_create_query())
+        self.execute(
+            "DELETE FROM %s WHERE experiment_id=? AND table_name=? AND bucket_size NOT IN (%s)"
+            % (rollups.COVERAGE_TABLE, ", ".join(str(x) for x in self.rollups)),
+            key,
+        )
+        # rows written before rollups were enabled aren't in them
+        start_iteration = None
+        if self.has_rows(table_name, experiment_id):
+            start_iteration = min(iterations)
+        self.execute(
+            "INSERT OR IGNORE INTO %s VALUES (?, ?, ?, ?)" % rollups.COVERAGE_TABLE,
+            [key + (x, start_iteration) for x in self.rollups],
+            many=True,
+        )
+
+    def has_rows(self, table_name, experiment_id=None):
+        if len(self.get_schema(table_name)) == 0:
+            return False
+        query, values = "SELECT 1 FROM %s" % table_name, ()
+        if experiment_id is not None:
+            query, values = query + " WHERE experiment_id=?", (experiment_id,)
+        return len(self.execute(query + " LIMIT 1", values, fetch=True)) > 0
+
+    def write_full_names(self, full_names):
+        # hashed group names -> the names they were hashed from
+        self.execute(
+            "CREATE TABLE IF NOT EXISTS _rk_hash_map (name text primary key, full_name text) WITHOUT ROWID"
+        )
+        self.execute(
+            "INSERT OR IGNORE INTO _rk_hash_map (name, full_name) VALUES (?, ?)",
+            list(full_names.items()),
+            many=True,
+        )
 
+    def get_full_name(self, table_name):
+        # Returns the name that table_name was hashed from, or table_name
+        # if it wasn't hashed. Names are cached, since they never change.
+        full_name = self.full_names.get(table_name)
+        if full_name is None:
+            try:
+                output = self.execute(
+                    "SELECT full_name FROM _rk_hash_map WHERE name=?",
+                    (table_name,),
+                    fetch=True,
+                )
+            except sqlite3.OperationalError as e:
+                if "no such table" not in str(e):
+                    raise
+                output = []
+            if len(output) == 0:
+                return table_name
+            full_name = self.full_names[table_name] = output[0]["full_name"]
+        return full_name
+
+    def get_covering_rollup_sizes(
+        self, table_name, experiment_name=None, start_iteration=None
+    ):
+        # bucket sizes of the rollups that have every row a query would read
+        try:
+            rows = self.execute(
+                "SELECT * FROM %s WHERE table_name=?" % rollups.COVERAGE_TABLE,
+                (table_name,),
+                fetch=True,
+            )
+        except sqlite3.OperationalError as e:
+            if "no such table" not in str(e):
+                raise
+            return []
+        covered = collections.defaultdict(set)
+        for x in rows:
+            if rollups.is_covered(x["start_iteration"], start_iteration):
+                covered[x["bucket_size"]].add(x["experiment_id"])
+        if len(covered) == 0:
+            return []
+        if not self.is_global:
+            needed = {0}
+        else:
+            # every experiment that has rows in the table
+            query = (
+                "SELECT id FROM experiment_ids AS e WHERE EXISTS "
+                "(SELECT 1 FROM %s WHERE experiment_id = e.id)" % table_name
+            )
+            values = ()
+            if experiment_name is not None:
+                query, values = query + " AND experiment_name=?", (experiment_name,)
+            needed = {x["id"] for x in self.execute(query, values, fetch=True)}
+        return [k for k, v in covered.items() if needed <= v]
+
+    def adapt_array(self, a):
+        if a is None:
+            return None
+        return adapt_array(a, self.compress_arrays)
+
+    def add_missing_columns(self, table_name, column_types):
+        schema = self.get_schema(table_name)
+        if len(schema) == 0:
+            self.create_table(table_name, column_types)
+            self.stats.add("%s/create_table" % self.stats_name)
+            schema = self.get_schema(table_name, refresh=True)
+        missing = [x for x in column_types if x not in schema]
+        if len(missing) == 0:
+            return
+        # another process may have added them already
+        schema = self.get_schema(table_name, refresh=True)
+        for x in missing:
+            if x in schema:
+                continue
+            try:
+                self.execute(
+                    "ALTER TABLE %s ADD COLUMN %s %s" % (table_name, x, column_types[x])
+                )
+                self.stats.add("%s/alter_table" % self.stats_name)
+            except sqlite3.OperationalError as e:
+                if "duplicate column name" not in str(e):
+                    raise
+            schema[x] = None
+
+    def create_table(self, table_name, column_types):
+        column_types = ", ".join("%s %s" % (k, v) for k, v in column_types.items())
+        if self.is_global:
+            column_types = (
+                "experiment_id integer, %s, FOREIGN KEY(experiment_id) REFERENCES experiment_ids(id) ON UPDATE CASCADE ON DELETE CASCADE"
+                % column_types
+            )
         self.execute(
             "CREATE TABLE IF NOT EXISTS %s (id integer primary key autoincrement, %s)"
             % (table_name, column_types)
         )
 
-        try:
+    def create_index(self, table_name):
+        if "[~iteration~]" in self.get_schema(table_name):
+            columns = (
+                "experiment_id, [~iteration~]" if self.is_global else "[~iteration~]"
+            )
             self.execute(
-                "INSERT INTO %s %s VALUES %s"
-                % (table_name, column_tuple, prepared_statement_filler),
-                column_values,
-                many=True,
+                "CREATE INDEX IF NOT EXISTS [%s_iteration_idx] ON %s (%s)"
+                % (table_name, table_name, columns)
             )
-        except sqlite3.OperationalError:
-            existing_column_names_list = [
-                "[{}]".format(x["name"])
-                for x in self.execute("PRAGMA table_info(%s)" % table_name, fetch=True)
+        self.indexed_tables.add(table_name)
+
+    def create_all_indexes(self):
+        for table_name in self.get_table_names():
+            self.create_index(table_name)
+
+    def get_table_names(self, conn=None, include_internal=False):
+        query = "SELECT name FROM sqlite_master WHERE type='table' AND name NOT IN ('experiment_ids', 'sqlite_sequence')"
+        if not include_internal:
+            # e.g. rollup tables
+            query += " AND substr(name, 1, 4) != '_rk_'"
+        if conn is not None:
+            return [x["name"] for x in conn.execute(query)]
+        return [x["name"] for x in self.execute(query, fetch=True)]
+
+    def changes_since(self, cursor=None, table_names=None, limit=None, conn=None):
+        # Returns the rows added since cursor, a dict of table name -> last
+        # seen id, and the new cursor. Ids only increase, because autoincrement
+        # never reuses them and writes to a database are serialized.
+        cursor = {} if cursor is None else dict(cursor)
+        changes = {}
+        owns_conn = conn is None and self.get_transaction() is None
+        if conn is None:
+            conn = self.get_transaction() or self.get_connection()
+        # one snapshot for every table
+        begin = not conn.in_transaction
+        try:
+            if begin:
+                conn.execute("BEGIN")
+            if table_names is None:
+                table_names = self.get_table_names(conn)
+            query = "SELECT * FROM %s WHERE id > ? ORDER BY id"
+            if limit is not None:
+                query += " LIMIT %d" % limit
+            for table_name in table_names:
+                try:
+                    rows = conn.execute(
+                        query % table_name, (cursor.get(table_name, 0),)
+                    ).fetchall()
+                except sqlite3.OperationalError as e:
+                    if "no such table" not in str(e):
+                        raise
+                    continue
+                if len(rows) > 0:
+                    changes[table_name] = rows
+                    cursor[table_name] = rows[-1]["id"]
+        finally:
+            if begin:
+                conn.rollback()
+            if owns_conn and not self.persistent:
+                conn.close()
+        return changes, cursor
+
+    def follow(self, cursor=None, table_names=None, interval=1.0, timeout=None):
+        # Yields (changes, cursor) whenever rows are added. It polls
+        # PRAGMA data_version, which only changes when another connection
+        # commits, so idle polls don't query any tables. Stops after timeout
+        # seconds without new rows.
+        conn = self.connect()
+        try:
+            last_version, last_change = None, time.monotonic()
+            while True:
+                version = conn.execute("PRAGMA data_version").fetchone()[0]
+                if version != last_version:
+                    last_version = version
+                    changes, cursor = self.changes_since(cursor, table_names, conn=conn)
+                    if len(changes) > 0:
+                        yield changes, cursor
+                        last_change = time.monotonic()
+                        continue
+                if timeout is not None and time.monotonic() - last_change >= timeout:
+                    return
+                time.sleep(interval)
+        finally:
+            conn.close()
+
+    def select(self, table_name, *args, **kwargs):
+        return self.query(*self.get_select_query(table_name, *args, **kwargs))
+
+    def iter_select(self, table_name, *args, chunk_size=65536, **kwargs):
+        query, values = self.get_select_query(table_name, *args, **kwargs)
+        return self.iter_query(query, values, chunk_size)
+
+    def get_select_query(
+        self,
+        table_name,
+        columns=None,
+        experiment_name=None,
+        start_iteration=None,
+        end_iteration=None,
+        latest=False,
+        fill_missing=False,
+    ):
+        schema = self.get_schema(table_name, refresh=True)
+        if len(schema) == 0:
+            raise ValueError("table %s does not exist" % table_name)
+        required = []
+        if columns is None:
+            columns = [x for x in schema if x not in ("[id]", "[experiment_id]")]
+        else:
+            columns = ["[{}]".format(x) for x in columns]
+            for x in columns:
+                if x not in schema and not fill_missing:
+                    raise ValueError("table %s has no column %s" % (table_name, x))
+            required = columns
+
+        # both ends are inclusive
+        conditions, values = [], []
+        if start_iteration is not None:
+            conditions.append("[~iteration~] >= ?")
+            values.append(start_iteration)
+        if end_iteration is not None:
+            conditions.append("[~iteration~] <= ?")
+            values.append(end_iteration)
+
+        # with fill_missing, columns that don't exist are selected as NULL
+        columns = ["t.%s" % x if x in schema else "NULL AS %s" % x for x in columns]
+        from_clause = "%s AS t" % table_name
+        if latest:
+            # the last row (per experiment) in which the requested columns are set
+            conditions += [
+                "%s IS NOT NULL" % (x if x in schema else "NULL") for x in required
             ]
-            for i, x in enumerate(column_names_list):
-                if x not in existing_column_names_list:
-                    self.execute(
-                        "ALTER TABLE %s ADD COLUMN %s %s"
-                        % (table_name, x, column_types_list[i])
-                    )
-            self.execute(
-                "INSERT INTO %s %s VALUES %s"
-                % (table_name, column_tuple, prepared_statement_filler),
-                column_values,
-                many=True,
+            if self.is_global:
+                conditions.append("experiment_id = e.id")
+            latest_row = (
+                "t.id = (SELECT id FROM %s WHERE %s ORDER BY [~iteration~] DESC LIMIT 1)"
+                % (table_name, " AND ".join(conditions) if conditions else "1")
             )
+            if self.is_global:
+                # loop over experiments, then look up one row for each
+                from_clause = "experiment_ids AS e CROSS JOIN %s ON %s" % (
+                    from_clause,
+                    latest_row,
+                )
+                conditions = []
+            else:
+                conditions = [latest_row]
+        else:
+            conditions = ["t.%s" % x for x in conditions]
+            if self.is_global:
+                from_clause = (
+                    "experiment_ids AS e JOIN %s ON t.experiment_id = e.id"
+                    % from_clause
+                )
 
+        order_by = "t.[~iteration~]"
         if self.is_global:
-            self.execute(
-                "UPDATE experiment_ids SET has_records=? WHERE experiment_name=?",
-                (int(True), experiment_name),
+            columns = ["e.experiment_name"] + columns
+            order_by = "t.experiment_id, %s" % order_by
+            if experiment_name is not None:
+                conditions.append("e.experiment_name = ?")
+                values.append(experiment_name)
+
+        query = "SELECT %s FROM %s" % (", ".join(columns), from_clause)
+        if len(conditions) > 0:
+            query += " WHERE %s" % " AND ".join(conditions)
+        query += " ORDER BY %s" % order_by
+        return query, values
+
+    def select_buckets(
+        self,
+        table_name,
+        series_name,
+        bucket_size,
+        experiment_name=None,
+        start_iteration=None,
+        end_iteration=None,
+    ):
+        # Count, mean, min, max and last of a numeric series per bucket of
+        # bucket_size iterations. Reads the coarsest rollup table that lines
+        # up with the buckets and the iteration range, and has every row in
+        # that range, if there is one, and otherwise aggregates the raw table.
+        available = self.get_covering_rollup_sizes(
+            table_name, experiment_name, start_iteration
+        )
+        rollup_size = rollups.choose_bucket_size(
+            available, bucket_size, start_iteration, end_iteration
+        )
+        self.stats.add(
+            "%s/select_buckets/%s"
+            % (self.stats_name, "raw" if rollup_size is None else rollup_size)
+        )
+        return self.query(
+            *rollups.get_buckets_query(
+                table_name,
+                series_name,
+                bucket_size,
+                rollup_size,
+                self.is_global,
+                experiment_name,
+                start_iteration,
+                end_iteration,
             )
+        )
+
+    def get_schema(self, table_name, refresh=False):
+        if refresh or table_name not in self.schemas:
+            # a dict, so columns keep the table's order
+            self.schemas[table_name] = {
+                "[{}]".format(x["name"]): None
+                for x in self.execute("PRAGMA table_info(%s)" % table_name, fetch=True)
+            }
+        return self.schemas[table_name]
 
     def query(self, query, values=()):
         return self.execute(query, values, fetch=True)
 
+    def iter_query(self, query, values=(), chunk_size=65536):
+        # yields (column_names, list_of_tuples) without loading every row at once
+        conn = self.get_transaction()
+        owns_conn = conn is None and not self.persistent
+        if conn is None:
+            conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.execute(query, values)
+            column_names = [x[0] for x in cursor.description]
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if len(rows) == 0:
+                    break
+                yield column_names, rows
+        finally:
+            if owns_conn:
+                conn.close()
+
     def table_exists(self, table_name):
         matches = self.execute(
             "SELECT name FROM sqlite_master WHERE type='table' AND name='%s'"
@@ -149,18 +739,116 @@ class DBManager:
         return len(matches) == 1
 
     def execute(self, query, values=(), many=False, fetch=False):
-        self.open()
-        self.cursor.executemany(query, values) if many else self.cursor.execute(
-            query, values
-        )
-        self.conn.commit()
-        output = self.cursor.fetchall() if fetch else None
-        self.conn.close()
+        conn = self.get_transaction()
+        if conn is not None:
+            return self.run(conn, query, values, many, fetch)
+        conn = self.get_connection()
+        try:
+            output = self.run(conn, query, values, many, fetch)
+            conn.commit()
+            self.maybe_checkpoint(conn)
+        finally:
+            if not self.persistent:
+                conn.close()
         return output
 
-    def open(self):
-        self.conn = sqlite3.connect(
-            self.db_path, detect_types=sqlite3.PARSE_DECLTYPES, timeout=60
+    def run(self, conn, query, values, many, fetch):
+        cursor = conn.cursor()
+        cursor.executemany(query, values) if many else cursor.execute(query, values)
+        return cursor.fetchall() if fetch else None
+
+    @contextlib.contextmanager
+    def transaction(self):
+        if self.get_transaction() is not None:
+            # nested transactions are part of the outer one
+            yield
+            return
+        conn = self.get_connection()
+        # waits for the write lock
+        with self.stats.time("%s/lock_wait" % self.stats_name):
+            conn.execute("BEGIN IMMEDIATE")
+        self.local.transaction = conn
+        try:
+            yield
+            conn.commit()
+            self.maybe_checkpoint(conn)
+        except BaseException:
+            conn.rollback()
+            # tables created or altered in the transaction are gone
+            self.schemas = {}
+            self.indexed_tables = set()
+            self.rollup_tables = set()
+            self.rollup_coverage = set()
+            raise
+        finally:
+            self.local.transaction = None
+            if not self.persistent:
+                conn.close()
+
+    def get_transaction(self):
+        if self.pid != os.getpid():
+            return None
+        return getattr(self.local, "transaction", None)
+
+    def get_connection(self):
+        if not self.persistent:
+            return self.connect()
+        if self.pid != os.getpid():
+            # connections must not be shared with a forked child,
+            # so drop the parent's without closing them
+            self.reset_connections()
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.connect()
+            self.local.conn = conn
+            with self.connections_lock:
+                self.connections.append(conn)
+        return conn
+
+    def connect(self):
+        timeout = self.pragmas.get("busy_timeout", 60000) / 1000
+        conn = sqlite3.connect(
+            self.db_path,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            timeout=timeout,
+            check_same_thread=not self.persistent,
         )
-        self.conn.row_factory = sqlite3.Row
-        self.cursor = self.conn.cursor()
+        conn.row_factory = sqlite3.Row
+        for k, v in self.pragmas.items():
+            conn.execute("PRAGMA %s=%s" % (k, v))
+        return conn
+
+    def maybe_checkpoint(self, conn):
+        if self.checkpoint_interval is None:
+            return
+        if time.time() - self.last_checkpoint >= self.checkpoint_interval:
+            self.checkpoint(conn=conn)
+
+    def checkpoint(self, mode="PASSIVE", conn=None):
+        # only has an effect in WAL mode
+        self.last_checkpoint = time.time()
+        if conn is not None:
+            return tuple(conn.execute("PRAGMA wal_checkpoint(%s)" % mode).fetchone())
+        return tuple(self.execute("PRAGMA wal_checkpoint(%s)" % mode, fetch=True)[0])
+
+    def reset_connections(self):
+        self.pid = os.getpid()
+        self.local = threading.local()
+        self.connections = []
+        self.connections_lock = threading.Lock()
+
+    def close(self):
+        if self.pid != os.getpid():
+            self.reset_connections()
+            return
+        with self.connections_lock:
+            connections, self.connections = self.connections, []
+        for conn in connections:
+            conn.close()
+        self.local = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,216 @@
+import collections
+import multiprocessing
+import os
+
+from . import utils as c_f
+from .record_keeper import RecordWriter
+
+# Lets every rank of a multi-process job log through one writer process,
+# which owns the CSV files and databases.
+#
+#   writer_process = WriterProcess(world_size=4, reduction=["mean", "per_rank"], folder=...)
+#   # in each rank:
+#   record_keeper = RecordKeeper(record_writer=writer_process.get_writer(rank), ...)
+#   ...
+#   writer_process.close()  # after the ranks are done
+
+
+def reduce_mean(values):
+    return sum(values) / len(values)
+
+
+REDUCTIONS = {
+    "mean": reduce_mean,
+    "sum": sum,
+    "min": min,
+    "max": max,
+}
+
+
+def is_number(x):
+    return isinstance(x, (int, float)) and not isinstance(x, bool)
+
+
+class RemoteRecordWriter:
+    # Used by RecordKeeper in each rank instead of a RecordWriter.
+    # Values are converted to python objects when appended, and sent to
+    # the writer process in one message per save_records call.
+    def __init__(self, queue, rank, folder):
+        self.queue = queue
+        self.rank = rank
+        self.folder = folder
+        self.records = collections.defaultdict(list)
+
+    def append(self, group_name, series_name, input_val, iteration):
+        if isinstance(input_val, (str, int, float)):
+            append_this = input_val
+        elif c_f.is_list_and_has_more_than_one_element(input_val):
+            append_this = c_f.convert_to_list(input_val)
+        else:
+            append_this = c_f.convert_to_scalar(input_val)
+            if hasattr(append_this, "item"):
+                append_this = append_this.item()  # numpy scalar
+        self.records[group_name].append((series_name, append_this, iteration))
+
+    def add_full_names(self, full_names):
+        self.queue.put(("full_names", self.rank, dict(full_names)))
+
+    def save_records(self):
+        if len(self.records) > 0:
+            self.queue.put(("records", self.rank, dict(self.records)))
+            self.records = collections.defaultdict(list)
+
+    def flush(self, wait=True):
+        self.save_records()
+
+    def close(self):
+        self.save_records()
+
+
+class Reducer:
+    # Combines the values that every rank logs for the same
+    # (group, series, iteration), and passes them on once all ranks have.
+    def __init__(self, reduction, world_size):
+        self.reductions = [reduction] if isinstance(reduction, str) else reduction
+        for x in self.reductions:
+            assert x == "per_rank" or x in REDUCTIONS
+        self.world_size = world_size
+        self.pending = {}
+
+    def add(self, rank, group_name, series_name, value, iteration):
+        # returns the (group, series, value, iteration) tuples to record
+        output = []
+        if "per_rank" in self.reductions:
+            output.append(
+                (group_name, "%s_rank%d" % (series_name, rank), value, iteration)
+            )
+        if len(self.reductions) == 1 and "per_rank" in self.reductions:
+            return output
+        key = (group_name, series_name, iteration)
+        values = self.pending.setdefault(key, {})
+        values[rank] = value
+        if len(values) >= self.world_size:
+            output.extend(self.reduce(key, self.pending.pop(key)))
+        return output
+
+    def reduce(self, key, values):
+        group_name, series_name, iteration = key
+        values = [values[k] for k in sorted(values)]
+        reductions = [x for x in self.reductions if x != "per_rank"]
+        if not all(is_number(x) for x in values):
+            # strings and lists aren't reduced, so keep the first rank's
+            return [(group_name, series_name, values[0], iteration)]
+        output = []
+        for x in reductions:
+            name = series_name if len(reductions) == 1 else "%s_%s" % (series_name, x)
+            output.append((group_name, name, REDUCTIONS[x](values), iteration))
+        return output
+
+    def flush(self, last_iteration=None):
+        # iterations that some ranks never logged, before last_iteration
+        keys = [
+            k for k in self.pending if last_iteration is None or k[2] < last_iteration
+        ]
+        return [x for k in keys for x in self.reduce(k, self.pending.pop(k))]
+
+
+def writer_loop(queue, reduction, world_size, record_writer_kwargs):
+    record_writer = RecordWriter(**record_writer_kwargs)
+    # Without a suffix, the ranks would overwrite each other's values
+    # for the same (group, series, iteration), so None means "per_rank".
+    reducer = Reducer(reduction or "per_rank", world_size)
+    # Rows are held until every rank has saved a later iteration,
+    # so that each iteration is saved in one flush. By then no rank will
+    # log that iteration again, so incomplete reductions are flushed too.
+    pending = collections.defaultdict(list)
+    last_iterations = {}
+    try:
+        while True:
+            message = queue.get()
+            if message is None:
+                break
+            kind, rank, records = message
+            if kind == "full_names":
+                # hashed group names, from a RecordKeeper in that rank
+                record_writer.add_full_names(records)
+                continue
+            for group_name, rows in records.items():
+                for series_name, value, iteration in rows:
+                    last_iterations[rank] = max(
+                        last_iterations.get(rank, iteration), iteration
+                    )
+                    x = (group_name, series_name, value, iteration)
+                    for y in reducer.add(rank, *x):
+                        pending[y[3]].append(y)
+            if world_size is None:
+                write_pending(record_writer, pending)
+            elif len(last_iterations) >= world_size:
+                last_iteration = min(last_iterations.values())
+                for x in reducer.flush(last_iteration):
+                    pending[x[3]].append(x)
+                write_pending(record_writer, pending, last_iteration)
+        for x in reducer.flush():
+            pending[x[3]].append(x)
+        write_pending(record_writer, pending)
+    finally:
+        record_writer.close()
+
+
+def write_pending(record_writer, pending, last_iteration=None):
+    iterations = sorted(
+        k for k in pending if last_iteration is None or k < last_iteration
+    )
+    for k in iterations:
+        for x in pending.pop(k):
+            record_writer.append(*x)
+    if len(iterations) > 0:
+        record_writer.save_records()
+
+
+class WriterProcess:
+    # Starts a process that owns a RecordWriter(**record_writer_kwargs).
+    # reduction is "per_rank" (or None) to record every rank's values,
+    # with a _rank<i> suffix added to every series,
+    # or one or more of "mean", "sum", "min", "max", optionally with "per_rank".
+    def __init__(
+        self,
+        world_size=None,
+        reduction=None,
+        max_queue_size=64,
+        mp_context=None,
+        **record_writer_kwargs
+    ):
+        if reduction is not None and reduction != "per_rank":
+            assert world_size is not None
+        ctx = multiprocessing.get_context(mp_context)
+        self.folder = record_writer_kwargs["folder"]
+        c_f.makedir_if_not_there(self.folder)
+        self.queue = ctx.Queue(maxsize=max_queue_size)
+        self.process = ctx.Process(
+            target=writer_loop,
+            args=(self.queue, reduction, world_size, record_writer_kwargs),
+            daemon=True,
+        )
+        self.process.start()
+        self.pid = os.getpid()
+
+    def get_writer(self, rank):
+        return RemoteRecordWriter(self.queue, rank, self.folder)
+
+    def close(self):
+        if self.pid != os.getpid() or self.process is None:
+            return
+        process, self.process = self.process, None
+        if process.is_alive():
+            self.queue.put(None)
+        process.join()
+        if process.exitcode != 0:
+            raise RuntimeError(
+                "the writer process exited with code %s" % process.exitcode
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,288 @@
+import argparse
+import concurrent.futures
+import csv
+import glob
+import json
+import os
+import sqlite3
+
+from . import utils as c_f
+from .db_utils import DBManager
+from .sharded_db import ShardedDBManager
+
+# Rebuilds databases from RecordWriter folders, e.g. after the global db was
+# lost, or to move experiments into a differently sharded global db.
+#
+#   python -m record_keeper.ingest runs/ --global_db_path global.db
+#
+# Folders are read in parallel by a process pool, from their logs.db or,
+# if it's missing, their CSV files. The rows are written in one transaction
+# per experiment, and indexes are only created once everything is written.
+
+
+def find_folders(root):
+    # RecordWriter folders are the ones with a logs.db or CSV files
+    output = []
+    for folder, _, filenames in os.walk(root):
+        if "logs.db" in filenames or any(x.endswith(".csv") for x in filenames):
+            output.append(folder)
+    return sorted(output)
+
+
+def parse_csv_value(x):
+    # CSV files don't store types, so this guesses them
+    if x == "":
+        return None
+    try:
+        return int(x)
+    except ValueError:
+        pass
+    try:
+        return float(x)
+    except ValueError:
+        pass
+    if x.startswith("["):
+        try:
+            return json.loads(x)
+        except ValueError:
+            pass
+    return x
+
+
+def read_csv(filename):
+    # yields (column_names, rows), starting a new block at each header,
+    # since the header is written again whenever the columns change
+    column_names, rows = None, []
+    with open(filename, newline="") as f:
+        for row in csv.reader(f):
+            if len(row) > 0 and row[0] == "~iteration~":
+                if column_names is not None and len(rows) > 0:
+                    yield column_names, rows
+                column_names, rows = row, []
+            elif column_names is not None and len(row) > 0:
+                rows.append(tuple(parse_csv_value(x) for x in row))
+    if column_names is not None and len(rows) > 0:
+        yield column_names, rows
+
+
+def read_csv_folder(folder):
+    for filename in sorted(glob.glob(os.path.join(folder, "*.csv"))):
+        table_name = os.path.splitext(os.path.basename(filename))[0]
+        for column_names, rows in read_csv(filename):
+            yield table_name, column_names, rows
+
+
+def read_db_folder(folder):
+    db = DBManager(os.path.join(folder, "logs.db"))
+    for table_name in db.get_table_names():
+        for column_names, rows in db.iter_select(table_name):
+            yield table_name, column_names, rows
+
+
+def read_full_names(folder):
+    # hashed group names -> the names they were hashed from,
+    # from hash_map.json and the logs.db's _rk_hash_map table
+    full_names = {}
+    filename = os.path.join(folder, "hash_map.json")
+    if os.path.isfile(filename):
+        with open(filename) as f:
+            full_names.update(json.load(f))
+    filename = os.path.join(folder, "logs.db")
+    if os.path.isfile(filename):
+        try:
+            rows = DBManager(filename).query("SELECT * FROM _rk_hash_map")
+        except sqlite3.OperationalError as e:
+            if "no such table" not in str(e):
+                raise
+            rows = []
+        full_names.update({x["name"]: x["full_name"] for x in rows})
+    return full_names
+
+
+def strip_column_suffix(name, value):
+    # DBManager.write adds the suffix back, based on the value
+    for suffix, check in [("_list", is_list), ("_array", c_f.is_array)]:
+        if name.endswith(suffix) and check(value):
+            return name[: -len(suffix)]
+    return name
+
+
+def is_list(x):
+    return isinstance(x, list)
+
+
+def to_dict_of_lists(column_names, rows):
+    # Drops the columns that are never set, and strips each column's suffix
+    # based on its first value that's set, like DBManager.write types it.
+    output = {}
+    for name, values in zip(column_names, zip(*rows)):
+        first = next((x for x in values if x is not None), None)
+        if first is not None:
+            output[strip_column_suffix(name, first)] = list(values)
+    return output
+
+
+def load_folder(folder, source="auto"):
+    # Runs in the process pool. Returns a list of (table_name, dict_of_lists).
+    if source == "auto":
+        has_db = os.path.isfile(os.path.join(folder, "logs.db"))
+        source = "db" if has_db else "csv"
+    reader = read_db_folder if source == "db" else read_csv_folder
+    output = []
+    for table_name, column_names, rows in reader(folder):
+        dict_of_lists = to_dict_of_lists(column_names, rows)
+        if len(dict_of_lists) > 0:
+            output.append((table_name, dict_of_lists))
+    return output
+
+
+def open_target(db_path, is_global, global_db_shards, pragmas, rollups=None):
+    kwargs = {
+        "persistent": True,
+        "pragmas": pragmas,
+        "create_indexes": False,
+        "rollups": rollups,
+    }
+    if global_db_shards is None:
+        return DBManager(db_path, is_global=is_global, **kwargs)
+    num_shards = None if global_db_shards == "experiment" else global_db_shards
+    return ShardedDBManager(db_path, num_shards=num_shards, **kwargs)
+
+
+def iter_loaded(folders, source, max_workers):
+    if max_workers == 0:
+        for folder in folders:
+            yield load_folder(folder, source)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+        yield from executor.map(load_folder, folders, [source] * len(folders))
+
+
+def ingest(
+    folders,
+    global_db_path,
+    experiment_names=None,
+    source="auto",
+    global_db_shards=None,
+    max_workers=None,
+    overwrite=False,
+    pragmas="bulk",
+    rollups=None,
+):
+    # Writes each folder into the global db as one experiment, named after
+    # the folder by default. Experiments that already have records are
+    # skipped, or replaced if overwrite=True. max_workers=0 reads the folders
+    # in this process. Returns the number of rows written per experiment.
+    if experiment_names is None:
+        experiment_names = [os.path.basename(os.path.normpath(x)) for x in folders]
+    assert len(experiment_names) == len(set(experiment_names))
+    db = open_target(global_db_path, True, global_db_shards, pragmas, rollups)
+    try:
+        output = {}
+        todo = []
+        for folder, experiment_name in zip(folders, experiment_names):
+            if db.experiment_name_has_records(experiment_name):
+                if not overwrite:
+                    continue
+                db.purge_experiment(experiment_name)
+            todo.append((folder, experiment_name))
+        loaded = iter_loaded([x[0] for x in todo], source, max_workers)
+        for (folder, experiment_name), records in zip(todo, loaded):
+            db.new_experiment(experiment_name)
+            full_names = read_full_names(folder)
+            if len(full_names) > 0:
+                db.write_full_names(full_names)
+            with db.transaction():
+                num_rows = 0
+                for table_name, dict_of_lists in records:
+                    db.write(
+                        table_name,
+                        dict_of_lists,
+                        experiment_name=experiment_name,
+                        update_has_records=False,
+                    )
+                    num_rows += len(dict_of_lists["~iteration~"])
+                if num_rows > 0:
+                    db.set_has_records(experiment_name)
+            output[experiment_name] = num_rows
+        db.create_all_indexes()
+    finally:
+        db.close()
+    return output
+
+
+def rebuild_logs_db(folder, pragmas="bulk", rollups=None):
+    # Rebuilds a folder's logs.db from its CSV files, replacing the old one.
+    # Returns the number of rows written.
+    filename = os.path.join(folder, "logs.db")
+    tmp_filename = filename + ".rebuild"
+    if os.path.isfile(tmp_filename):
+        os.remove(tmp_filename)
+    full_names = read_full_names(folder)
+    db = open_target(tmp_filename, False, None, pragmas, rollups)
+    num_rows = 0
+    try:
+        with db.transaction():
+            if len(full_names) > 0:
+                db.write_full_names(full_names)
+            for table_name, dict_of_lists in load_folder(folder, "csv"):
+                db.write(table_name, dict_of_lists)
+                num_rows += len(dict_of_lists["~iteration~"])
+        db.create_all_indexes()
+    finally:
+        db.close()
+    os.replace(tmp_filename, filename)
+    return num_rows
+
+
+def get_global_db_shards(shards):
+    if shards is None or shards == "experiment":
+        return shards
+    return int(shards)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load RecordWriter folders into a global db, or rebuild their logs.db"
+    )
+    parser.add_argument(
+        "paths", nargs="+", help="RecordWriter folders, or parents of them"
+    )
+    parser.add_argument("--global_db_path", type=str, default=None)
+    # "experiment" or a number, like RecordWriter's global_db_shards
+    parser.add_argument("--global_db_shards", type=str, default=None)
+    parser.add_argument("--source", choices=["auto", "db", "csv"], default="auto")
+    parser.add_argument("--max_workers", type=int, default=None)
+    parser.add_argument("--overwrite", action="store_true")
+    # bucket sizes of rollup tables to fill, like RecordWriter's rollups
+    parser.add_argument("--rollups", nargs="+", type=int, default=None)
+    parser.add_argument(
+        "--rebuild_logs_db",
+        action="store_true",
+        help="rebuild each folder's logs.db from its CSV files",
+    )
+    args = parser.parse_args()
+    assert args.rebuild_logs_db or args.global_db_path is not None
+
+    folders = [x for path in args.paths for x in find_folders(path)]
+    if args.rebuild_logs_db:
+        for folder in folders:
+            num_rows = rebuild_logs_db(folder, rollups=args.rollups)
+            print("%s: %d rows" % (folder, num_rows))
+    if args.global_db_path is not None:
+        output = ingest(
+            folders,
+            args.global_db_path,
+            source=args.source,
+            global_db_shards=get_global_db_shards(args.global_db_shards),
+            max_workers=args.max_workers,
+            overwrite=args.overwrite,
+            rollups=args.rollups,
+        )
+        for experiment_name, num_rows in output.items():
+            print("%s: %d rows" % (experiment_name, num_rows))
+        print("%d experiments skipped" % (len(folders) - len(output)))
+
+
+if __name__ == "__main__":
+    main()
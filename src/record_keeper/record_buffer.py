@@ -0,0 +1,167 @@
+import array
+
+from . import utils as c_f
+
+# the kind of a column whose values are numpy arrays of one shape and dtype,
+# which are copied into the rows of one 2-d array
+BLOCK = "block"
+
+
+class Column:
+    def __init__(self):
+        self.values = None
+        self.kind = None
+        self.mask = bytearray()  # 1 where a value has been set
+
+    def set(self, row, value):
+        if type(value) is not self.kind and self.kind is not object:
+            self.set_kind(value)
+        if row >= len(self.mask):
+            self.grow(row + 1)
+        if self.kind is object and c_f.is_array(value):
+            # e.g. from a tensor, whose memory might be reused
+            value = value.copy()
+        try:
+            self.values[row] = value
+        except OverflowError:
+            self.convert_to_list()
+            self.values[row] = value
+        self.mask[row] = 1
+
+    def set_kind(self, value):
+        if self.values is None:
+            if type(value) is int:
+                self.kind, typecode = int, "q"
+            elif isinstance(value, float):
+                self.kind, typecode = float, "d"
+            elif c_f.is_array(value) and value.ndim > 0:
+                import numpy as np
+
+                self.kind = BLOCK
+                self.values = np.empty((len(self.mask),) + value.shape, value.dtype)
+                return
+            else:
+                self.kind = object
+                self.values = [None] * len(self.mask)
+                return
+            self.values = array.array(typecode, [0]) * len(self.mask)
+        elif self.kind is BLOCK:
+            if not (
+                c_f.is_array(value)
+                and value.shape == self.values.shape[1:]
+                and value.dtype == self.values.dtype
+            ):
+                self.convert_to_list()
+        elif not (self.kind is float and isinstance(value, float)):
+            # mixed types are kept as python objects, so nothing is coerced
+            self.convert_to_list()
+
+    def convert_to_list(self):
+        self.values = self.tolist(len(self.mask))
+        self.kind = object
+
+    def grow(self, length):
+        n = max(length, 2 * len(self.mask)) - len(self.mask)
+        self.mask.extend(bytes(n))
+        if self.kind is BLOCK:
+            import numpy as np
+
+            values = np.empty(
+                (len(self.mask),) + self.values.shape[1:], self.values.dtype
+            )
+            values[: len(self.values)] = self.values
+            self.values = values
+        elif self.values is not None:
+            self.values.extend([None if self.kind is object else 0] * n)
+
+    def get(self, row):
+        if row < len(self.mask) and self.mask[row]:
+            return self.values[row]
+        return None
+
+    def tolist(self, length):
+        if self.values is None:
+            return [None] * length
+        values = list(self.values[:length])
+        if self.mask.count(0, 0, length) > 0:
+            values = [v if m else None for v, m in zip(values, self.mask)]
+        values.extend([None] * (length - len(values)))
+        return values
+
+
+class RecordBuffer:
+    # Holds one group's records as one iteration index shared by
+    # array-backed columns, so appending doesn't create a dict per value.
+    def __init__(self):
+        self.iterations = []
+        self.rows = {}
+        self.columns = {}
+        self.is_sorted = True
+
+    def append(self, series_name, value, iteration):
+        row = self.rows.get(iteration)
+        if row is None:
+            row = self.add_row(iteration)
+        column = self.columns.get(series_name)
+        if column is None:
+            column = self.columns[series_name] = Column()
+        if type(value) is column.kind:
+            try:
+                column.values[row] = value
+                column.mask[row] = 1
+                return
+            except (IndexError, OverflowError):
+                pass
+        elif column.kind is BLOCK:
+            block = column.values
+            if (
+                row < len(block)
+                and c_f.is_array(value)
+                and value.shape == block.shape[1:]
+                and value.dtype == block.dtype
+            ):
+                block[row] = value
+                column.mask[row] = 1
+                return
+        column.set(row, value)
+
+    def add_row(self, iteration):
+        row = len(self.iterations)
+        if row > 0 and iteration < self.iterations[-1]:
+            self.is_sorted = False
+        self.rows[iteration] = row
+        self.iterations.append(iteration)
+        return row
+
+    def to_dict_of_lists(self):
+        n = len(self.iterations)
+        output = {"~iteration~": list(self.iterations)}
+        for k, v in self.columns.items():
+            output[k] = v.tolist(n)
+        if not self.is_sorted:
+            order = sorted(range(n), key=self.iterations.__getitem__)
+            output = {k: [v[i] for i in order] for k, v in output.items()}
+        return output
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __contains__(self, series_name):
+        return series_name in self.columns
+
+    def __getitem__(self, series_name):
+        column = self.columns[series_name]
+        return {
+            iteration: column.get(row)
+            for iteration, row in self.rows.items()
+            if row < len(column.mask) and column.mask[row]
+        }
+
+    def keys(self):
+        return self.columns.keys()
+
+    def items(self):
+        return ((k, self[k]) for k in self.columns)
@@ -1,9 +1,54 @@
 import collections
 import datetime
+import operator
 import os
+import queue
+import threading
+import weakref
 
 from . import utils as c_f
+from .csv_sink import CSVSink
 from .db_utils import DBManager
+from .record_buffer import RecordBuffer
+from .sampling import SamplingPolicies
+from .sharded_db import ShardedDBManager
+from .spool import Spool, read_segment
+from .stats import get_stats
+
+
+class TraversalPlan:
+    # What update_records found on an object the last time it walked it:
+    # the attributes to record, the names to record them under,
+    # and the nested objects to recurse into.
+    def __init__(self, obj_ref, the_obj_ref, attr_lists, name, next_parent_name):
+        self.obj_ref = obj_ref
+        self.the_obj_ref = the_obj_ref
+        self.attr_lists = attr_lists
+        self.attr_list = [k for x in attr_lists if x is not None for k in x]
+        self.name = name
+        self.next_parent_name = next_parent_name
+        # the type of each value in vars(obj), and the attributes that
+        # have to be the same objects, e.g. the ones recursed into
+        self.var_types = None
+        self.children = []
+        self.watched_attrs = []
+
+    def is_valid(self, input_obj, attr_lists, obj_vars):
+        if self.obj_ref() is not input_obj or attr_lists != self.attr_lists:
+            return False
+        if obj_vars is None:
+            return True
+        if tuple(map(type, obj_vars.values())) != self.var_types:
+            return False
+        for attr_name, attr, elements in self.watched_attrs:
+            x = obj_vars.get(attr_name)
+            if x is not attr:
+                return False
+            if elements is not None and (
+                len(x) != len(elements) or not all(map(operator.is_, x, elements))
+            ):
+                return False
+        return True
 
 
 class RecordKeeper:
@@ -12,6 +57,10 @@ class RecordKeeper:
         tensorboard_writer=None,
         record_writer=None,
         attributes_to_search_for=None,
+        defer_tensor_conversion=False,
+        cache_traversal=True,
+        sampling_policies=None,
+        stats=False,
     ):
         self.tensorboard_writer = tensorboard_writer
         self.record_writer = record_writer
@@ -19,8 +68,38 @@ class RecordKeeper:
             [] if attributes_to_search_for is None else attributes_to_search_for
         )
         self.hash_map = {}
+        # entries of hash_map that haven't been saved yet
+        self.new_full_names = {}
+        self.defer_tensor_conversion = defer_tensor_conversion
+        self.pending_tensors = None
+        self.cache_traversal = cache_traversal
+        self.traversal_plans = {}
+        self.sampling_policies = (
+            None if sampling_policies is None else SamplingPolicies(sampling_policies)
+        )
+        self.stats = get_stats(stats)
+        self.in_update_records = False
 
     def append_data(self, group_name, series_name, value, iteration):
+        if self.sampling_policies is not None:
+            policy = self.sampling_policies.get(
+                group_name, series_name, self.hash_map.get(group_name)
+            )
+            if policy is not None:
+                for suffix, v, i in policy.add(value, iteration):
+                    self.write_data(group_name, series_name + suffix, v, i)
+                return
+        self.write_data(group_name, series_name, value, iteration)
+
+    def flush_sampling_policies(self):
+        # emits the partially filled windows, e.g. at the end of training
+        if self.sampling_policies is not None:
+            for group_name, series_name, value, iteration in list(
+                self.sampling_policies.flush()
+            ):
+                self.write_data(group_name, series_name, value, iteration)
+
+    def write_data(self, group_name, series_name, value, iteration):
         if self.tensorboard_writer:
             tag_name = "%s/%s" % (group_name, series_name)
             if (value is not None) and (
@@ -40,9 +119,27 @@ class RecordKeeper:
         if group == "":
             raise ValueError("group cannot be an empty string")
         new_group = c_f.hash_if_too_long(group)
-        if new_group != group:
+        if new_group != group and new_group not in self.hash_map:
             self.hash_map[new_group] = group
-        self.append_data(new_group, series, value, global_iteration)
+            self.new_full_names[new_group] = group
+        if (
+            self.pending_tensors is not None
+            and c_f.is_tensor(value)
+            and value.nelement() > 0
+        ):
+            self.pending_tensors.append((new_group, series, value, global_iteration))
+        else:
+            self.append_data(new_group, series, value, global_iteration)
+
+    def append_pending_tensors(self):
+        if len(self.pending_tensors) == 0:
+            return
+        groups, series, values, iterations = zip(*self.pending_tensors)
+        with self.stats.time("tensor_conversion"):
+            values = c_f.convert_tensors(values)
+        self.stats.add("tensors_converted", len(values))
+        for x in zip(groups, series, values, iterations):
+            self.append_data(*x)
 
     def update_records(
         self,
@@ -52,6 +149,28 @@ class RecordKeeper:
         parent_name="",
         recursive_types=None,
     ):
+        if not self.in_update_records:
+            self.in_update_records = True
+            if self.defer_tensor_conversion:
+                # collect tensors from the whole traversal,
+                # and convert them all at once at the end
+                self.pending_tensors = []
+            try:
+                with self.stats.time("update_records"):
+                    self.update_records(
+                        record_these,
+                        global_iteration,
+                        custom_attr_func=custom_attr_func,
+                        parent_name=parent_name,
+                        recursive_types=recursive_types,
+                    )
+                    if self.pending_tensors is not None:
+                        self.append_pending_tensors()
+            finally:
+                self.in_update_records = False
+                self.pending_tensors = None
+            return
+
         kwargs = {
             "global_iteration": global_iteration,
             "custom_attr_func": custom_attr_func,
@@ -72,33 +191,89 @@ class RecordKeeper:
                 next_parent_name = c_f.next_parent_name(parent_name, name_in_dict)
                 self.update_records(input_obj, parent_name=next_parent_name, **kwargs)
             else:
-                the_obj = c_f.try_getting_dataparallel_module(input_obj)
-                attr_list = self.get_attr_list_for_record_keeper(the_obj)
-                name = self.get_record_name(name_in_dict, the_obj)
-                next_record_these = {f"{k}": getattr(the_obj, k) for k in attr_list}
-                next_parent_name = c_f.next_parent_name(parent_name, name)
+                plan = self.get_traversal_plan(
+                    input_obj, name_in_dict, parent_name, recursive_types
+                )
+                the_obj = plan.the_obj_ref()
+                next_record_these = {
+                    f"{k}": getattr(the_obj, k) for k in plan.attr_list
+                }
                 self.update_records(
-                    next_record_these, parent_name=next_parent_name, **kwargs
+                    next_record_these, parent_name=plan.next_parent_name, **kwargs
                 )
                 if custom_attr_func is not None:
                     self.update_records(
                         custom_attr_func(the_obj),
-                        parent_name=next_parent_name,
+                        parent_name=plan.next_parent_name,
                         **kwargs,
                     )
-                if recursive_types is not None:
-                    for attr_name, attr in vars(input_obj).items():
-                        if any(isinstance(attr, rt) for rt in recursive_types):
-                            next_record_these = {f"{name}_{attr_name}": attr}
-                            self.update_records(next_record_these, **kwargs)
-                        elif isinstance(attr, (list, tuple)):
-                            if any(
-                                all(isinstance(aaa, rt) for aaa in attr)
-                                for rt in recursive_types
-                            ):
-                                for i, aaa in enumerate(attr):
-                                    next_record_these = {f"{name}_{attr_name}{i}": aaa}
-                                    self.update_records(next_record_these, **kwargs)
+                for k, v in plan.children:
+                    if isinstance(v, dict) and len(v) == 0:
+                        continue  # e.g. the hook dicts of a torch module
+                    self.update_records({k: v}, **kwargs)
+
+    def get_traversal_plan(self, input_obj, name_in_dict, parent_name, recursive_types):
+        if not self.cache_traversal:
+            return self.make_traversal_plan(
+                input_obj, name_in_dict, parent_name, recursive_types
+            )
+        if recursive_types is not None:
+            recursive_types = tuple(recursive_types)
+        key = (id(input_obj), name_in_dict, parent_name, recursive_types)
+        plan = self.traversal_plans.get(key)
+        if plan is not None:
+            the_obj = plan.the_obj_ref()
+            attr_lists = [
+                getattr(the_obj, k, None) for k in self.attributes_to_search_for
+            ]
+            obj_vars = vars(input_obj) if recursive_types is not None else None
+            if plan.is_valid(input_obj, attr_lists, obj_vars):
+                return plan
+        plan = self.make_traversal_plan(
+            input_obj, name_in_dict, parent_name, recursive_types
+        )
+        try:
+            # forget the plan when the object is garbage collected,
+            # before its id can be reused
+            plan.obj_ref = weakref.ref(
+                input_obj, lambda _: self.traversal_plans.pop(key, None)
+            )
+            plan.the_obj_ref = weakref.ref(plan.the_obj_ref())
+        except TypeError:
+            return plan
+        self.traversal_plans[key] = plan
+        return plan
+
+    def make_traversal_plan(
+        self, input_obj, name_in_dict, parent_name, recursive_types
+    ):
+        the_obj = c_f.try_getting_dataparallel_module(input_obj)
+        attr_lists = [getattr(the_obj, k, None) for k in self.attributes_to_search_for]
+        name = self.get_record_name(name_in_dict, the_obj)
+        plan = TraversalPlan(
+            obj_ref=lambda: None,
+            the_obj_ref=lambda: the_obj,
+            attr_lists=[None if x is None else list(x) for x in attr_lists],
+            name=name,
+            next_parent_name=c_f.next_parent_name(parent_name, name),
+        )
+        if recursive_types is not None:
+            obj_vars = vars(input_obj)
+            plan.var_types = tuple(map(type, obj_vars.values()))
+            for attr_name, attr in obj_vars.items():
+                if any(isinstance(attr, rt) for rt in recursive_types):
+                    plan.children.append((f"{name}_{attr_name}", attr))
+                    plan.watched_attrs.append((attr_name, attr, None))
+                elif isinstance(attr, (list, tuple)):
+                    # the elements decide whether it's recursed into
+                    plan.watched_attrs.append((attr_name, attr, list(attr)))
+                    if any(
+                        all(isinstance(aaa, rt) for aaa in attr)
+                        for rt in recursive_types
+                    ):
+                        for i, aaa in enumerate(attr):
+                            plan.children.append((f"{name}_{attr_name}{i}", aaa))
+        return plan
 
     def get_attr_list_for_record_keeper(self, input_obj):
         attr_list = []
@@ -120,16 +295,33 @@ class RecordKeeper:
     def get_record(self, group_name):
         return self.record_writer.records[group_name]
 
+    def get_stats(self):
+        return self.stats.to_dict()
+
+    def log_stats(self, iteration, group_name="record_keeper_stats"):
+        # writes the RecordKeeper and RecordWriter stats as one more group
+        stats = self.stats.to_flat_dict()
+        if self.record_writer and self.record_writer.stats is not self.stats:
+            stats.update(self.record_writer.stats.to_flat_dict())
+        for k, v in stats.items():
+            self.write_data(group_name, k, v, iteration)
+
     def save_records(self):
+        if len(self.new_full_names) > 0:
+            self.record_writer.add_full_names(self.new_full_names)
         self.record_writer.save_records()
-        if len(self.hash_map) > 0:
+        if len(self.new_full_names) > 0:
             c_f.write_dict_to_json(
                 self.hash_map, os.path.join(self.record_writer.folder, "hash_map.json")
             )
+            self.new_full_names = {}
 
     def query(self, query, *args, **kwargs):
         return self.record_writer.query(query, *args, **kwargs)
 
+    def select(self, group_name, *args, **kwargs):
+        return self.record_writer.select(group_name, *args, **kwargs)
+
     def table_exists(self, table_name, *args, **kwargs):
         return self.record_writer.table_exists(table_name, *args, **kwargs)
 
@@ -142,56 +334,268 @@ class RecordWriter:
         experiment_name=None,
         is_new_experiment=True,
         save_lists=False,
+        persistent_connections=False,
+        atomic_flush=False,
+        pragmas=None,
+        checkpoint_interval=None,
+        async_writes=False,
+        max_queue_size=2,
+        max_open_csv_files=64,
+        list_format="json",
+        compress_lists=False,
+        global_db_shards=None,
+        stats=False,
+        spool=False,
+        spool_sync_interval=1.0,
+        rollups=None,
     ):
         self.records = self.get_empty_nested_dict()
         self.folder = folder
+        self.stats = get_stats(stats)
+        self.new_full_names = {}
         self.save_lists = save_lists
+        assert list_format in ["json", "array"]
+        self.list_format = list_format
+        self.atomic_flush = atomic_flush
         self.records_that_are_lists = set()
+        self.csv_sinks = {}
+        self.open_csv_sinks = collections.OrderedDict()
+        self.max_open_csv_files = max_open_csv_files
         c_f.makedir_if_not_there(self.folder)
-        self.local_db = DBManager(os.path.join(self.folder, "logs.db"), is_global=False)
+        db_kwargs = {
+            "persistent": persistent_connections,
+            "pragmas": pragmas,
+            "checkpoint_interval": checkpoint_interval,
+            "compress_arrays": compress_lists,
+            "stats": self.stats,
+            "rollups": rollups,
+        }
+        self.local_db = DBManager(
+            os.path.join(self.folder, "logs.db"),
+            is_global=False,
+            stats_name="local_db",
+            **db_kwargs,
+        )
+        db_kwargs["stats_name"] = "global_db"
         self.global_db = None
         self.experiment_name = experiment_name
         if global_db_path:
             assert self.experiment_name is not None
-            self.global_db = DBManager(global_db_path, is_global=True)
+            if global_db_shards is None:
+                self.global_db = DBManager(global_db_path, is_global=True, **db_kwargs)
+            else:
+                # global_db_path is a folder of shards
+                self.global_db = ShardedDBManager(
+                    global_db_path,
+                    num_shards=(
+                        None if global_db_shards == "experiment" else global_db_shards
+                    ),
+                    **db_kwargs,
+                )
             if is_new_experiment:
                 self.global_db.new_experiment(self.experiment_name)
+        self.async_writes = async_writes
+        self.worker_error = None
+        if self.async_writes:
+            self.queue = queue.Queue(maxsize=max_queue_size)
+            self.worker = threading.Thread(target=self.worker_loop, daemon=True)
+            self.worker.start()
+        self.spool = None
+        if spool:
+            self.spool = Spool(self.folder, spool_sync_interval)
+            self.replay_spool()
 
     def get_empty_nested_dict(self):
-        return collections.defaultdict(lambda: collections.OrderedDict())
+        return collections.defaultdict(RecordBuffer)
 
     def append(self, group_name, series_name, input_val, iteration):
-        curr_dict = self.records[group_name]
-        if isinstance(input_val, str):
+        if isinstance(input_val, (str, int, float)):
+            # already a python value, e.g. from convert_tensors
             append_this = input_val
+        elif c_f.is_array(input_val) or c_f.is_tensor(input_val):
+            if input_val.ndim > 0 and len(input_val) > 1:
+                # Copied into a 2-d block per series by RecordBuffer,
+                # and only converted to lists when saved.
+                if not c_f.is_array(input_val):
+                    input_val = c_f.convert_to_numpy(input_val)
+                append_this = input_val
+                if input_val.dtype.hasobject:
+                    append_this = input_val.tolist()
+                self.records_that_are_lists.add((group_name, series_name))
+            else:
+                append_this = c_f.convert_to_scalar(input_val)
         elif c_f.is_list_and_has_more_than_one_element(input_val):
-            append_this = c_f.convert_to_list(input_val)
+            if self.list_format == "array":
+                append_this = c_f.convert_to_numpy(input_val)
+                if append_this.dtype.hasobject:
+                    # e.g. lists with None, which are saved as json
+                    append_this = c_f.convert_to_list(input_val)
+            else:
+                append_this = c_f.convert_to_list(input_val)
             self.records_that_are_lists.add((group_name, series_name))
         else:
             append_this = c_f.convert_to_scalar(input_val)
-        c_f.try_add_to_dict(curr_dict, series_name, append_this, iteration)
+        self.records[group_name].append(series_name, append_this, iteration)
+        if self.spool is not None:
+            self.spool.append((group_name, series_name, append_this, iteration))
+
+    def replay_spool(self):
+        # Records that were appended but not saved before the process died.
+        # They go through append again, so they're spooled until saved.
+        # Records that were saved just before the crash can be written twice.
+        segments = self.spool.get_segments()
+        num_records = 0
+        for filename in segments:
+            for record in read_segment(filename):
+                self.append(*record)
+                num_records += 1
+        if num_records > 0:
+            self.flush(wait=True)
+        self.stats.add("spool_replayed", num_records)
+        for filename in segments:
+            self.spool.delete(filename)
+
+    def add_full_names(self, full_names):
+        # hashed group names -> the names they were hashed from,
+        # which are written to the dbs by the next save_records
+        self.new_full_names.update(full_names)
+
+    def write_full_names(self):
+        if len(self.new_full_names) > 0:
+            self.local_db.write_full_names(self.new_full_names)
+            if self.global_db is not None:
+                self.global_db.write_full_names(self.new_full_names)
+            self.new_full_names = {}
+
+    def get_full_name(self, group_name, use_global_db=False):
+        return self.get_db(use_global_db).get_full_name(group_name)
 
     def save_records(self):
-        for k, v in self.records.items():
+        self.raise_worker_error()
+        self.write_full_names()
+        with self.stats.time("save_records"):
+            if self.worker_is_running():
+                records, self.records = self.records, self.get_empty_nested_dict()
+                segment = self.spool.rotate() if self.spool is not None else None
+                # blocks if the worker is too far behind
+                with self.stats.time("queue_wait"):
+                    self.queue.put((records, segment))
+            else:
+                self.write_records(self.records)
+                self.records = self.get_empty_nested_dict()
+                if self.spool is not None:
+                    self.spool.delete(self.spool.rotate())
+
+    def write_records(self, records):
+        with self.stats.time("prepare_records"):
+            records = self.prepare_records(records)
+        for k, v in records:
+            self.stats.add("rows/%s" % k, len(v["~iteration~"]))
+        if self.atomic_flush:
+            with self.stats.time("db_write"):
+                self.write_records_to_dbs(records)
+            for k, v in records:
+                self.write_record_to_csv(k, v)
+        else:
+            for k, v in records:
+                self.write_record_to_csv(k, v)
+                with self.stats.time("local_db_write"):
+                    self.local_db.write(k, v)
+                if self.global_db is not None:
+                    with self.stats.time("global_db_write"):
+                        self.global_db.write(k, v, experiment_name=self.experiment_name)
+
+    def worker_loop(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                records, segment = item
+                with self.stats.time("write_records"):
+                    self.write_records(records)
+                if segment is not None:
+                    # the records are saved, so they don't need replaying
+                    self.spool.delete(segment)
+            except Exception as e:
+                if self.worker_error is None:
+                    self.worker_error = e
+            finally:
+                self.queue.task_done()
+
+    def worker_is_running(self):
+        return self.async_writes and self.worker.is_alive()
+
+    def raise_worker_error(self):
+        if self.worker_error is not None:
+            e, self.worker_error = self.worker_error, None
+            raise e
+
+    def flush(self, wait=True):
+        self.save_records()
+        if self.worker_is_running() and wait:
+            self.queue.join()
+            self.raise_worker_error()
+
+    def prepare_records(self, records):
+        output = []
+        for k, v in records.items():
             if len(v) > 0:
-                v = c_f.separate_iterations_from_series(v)
-                len_of_list = len(v[sorted(list(v.keys()))[0]])  # get random sub list
-                assert all(
-                    len(v[sub_key]) == len_of_list for sub_key in v.keys()
-                )  # assert all lists are the same length
+                v = v.to_dict_of_lists()
                 if not self.save_lists:
                     self.remove_lists(v)
-                base_filename = os.path.join(self.folder, k)
-                c_f.write_dict_of_lists_to_csv(v, base_filename + ".csv", append=True)
+                elif self.list_format == "json":
+                    # once for both the CSV file and the dbs
+                    for name, values in v.items():
+                        if c_f.has_arrays(values):
+                            v[name] = c_f.encode_arrays(values)
+                output.append((k, v))
+        return output
+
+    def write_record_to_csv(self, group_name, record):
+        record = {
+            k: c_f.encode_arrays(v) if c_f.has_arrays(v) else v
+            for k, v in record.items()
+        }
+        with self.stats.time("csv_write"):
+            num_bytes = self.get_csv_sink(group_name).write(record)
+        self.stats.add("csv_bytes/%s" % group_name, num_bytes)
+
+    def get_csv_sink(self, group_name):
+        sink = self.csv_sinks.get(group_name)
+        if sink is None:
+            filename = os.path.join(self.folder, group_name + ".csv")
+            sink = self.csv_sinks[group_name] = CSVSink(filename)
+        self.open_csv_sinks[group_name] = sink
+        self.open_csv_sinks.move_to_end(group_name)
+        # closed sinks keep their header, so reopening them is cheap
+        while len(self.open_csv_sinks) > self.max_open_csv_files:
+            self.open_csv_sinks.popitem(last=False)[1].close()
+        return sink
+
+    def write_records_to_dbs(self, records):
+        # one transaction per database, so a failed flush leaves neither db
+        # partially written and self.records untouched
+        with self.local_db.transaction():
+            for k, v in records:
                 self.local_db.write(k, v)
-                if self.global_db is not None:
-                    self.global_db.write(k, v, experiment_name=self.experiment_name)
-        self.records = self.get_empty_nested_dict()
+            if self.global_db is not None and len(records) > 0:
+                with self.global_db.transaction():
+                    for k, v in records:
+                        self.global_db.write(
+                            k,
+                            v,
+                            experiment_name=self.experiment_name,
+                            update_has_records=False,
+                        )
+                    self.global_db.set_has_records(self.experiment_name)
 
     def remove_lists(self, record):
         remove_keys = []
         for k, v in record.items():
-            if isinstance(v[0], list):
+            # the first value that's set, like DBManager.write
+            first = next((x for x in v if x is not None), None)
+            if isinstance(first, list) or c_f.is_array(first):
                 remove_keys.append(k)
         for k in remove_keys:
             record.pop(k, None)
@@ -199,13 +603,124 @@ class RecordWriter:
     def get_db(self, use_global_db):
         return self.global_db if use_global_db else self.local_db
 
-    def query(self, query, values=(), use_global_db=False, return_dict=False):
-        output = self.get_db(use_global_db).query(query, values)
+    def query(
+        self,
+        query,
+        values=(),
+        use_global_db=False,
+        return_dict=False,
+        return_numpy=False,
+    ):
+        db = self.get_db(use_global_db)
+        if return_numpy:
+            return c_f.chunks_to_arrays(db.iter_query(query, values))
+        output = db.query(query, values)
         if return_dict:
-            if len(output) > 0:
-                return {k: [row[k] for row in output] for k in output[0].keys()}
-            return {}
+            return c_f.rows_to_dict(output)
         return output
 
+    def iter_query(
+        self, query, values=(), use_global_db=False, chunk_size=65536, return_numpy=True
+    ):
+        # yields one dict of columns per chunk of rows
+        db = self.get_db(use_global_db)
+        for column_names, rows in db.iter_query(query, values, chunk_size):
+            if return_numpy:
+                yield c_f.rows_to_arrays(column_names, rows)
+            else:
+                yield dict(zip(column_names, map(list, zip(*rows))))
+
+    def select(
+        self,
+        group_name,
+        series_names=None,
+        start_iteration=None,
+        end_iteration=None,
+        experiment_name=None,
+        latest=False,
+        use_global_db=False,
+        return_dict=True,
+        return_numpy=False,
+    ):
+        db = self.get_db(use_global_db)
+        # groups can be selected by the names they were hashed from
+        group_name = c_f.hash_if_too_long(group_name)
+        kwargs = {
+            "columns": None if series_names is None else ["~iteration~"] + series_names,
+            "experiment_name": experiment_name,
+            "start_iteration": start_iteration,
+            "end_iteration": end_iteration,
+            "latest": latest,
+        }
+        if return_numpy:
+            return c_f.chunks_to_arrays(db.iter_select(group_name, **kwargs))
+        output = db.select(group_name, **kwargs)
+        if return_dict:
+            return c_f.rows_to_dict(output)
+        return output
+
+    def get_stats(self):
+        return self.stats.to_dict()
+
+    def select_buckets(
+        self,
+        group_name,
+        series_name,
+        bucket_size,
+        start_iteration=None,
+        end_iteration=None,
+        experiment_name=None,
+        use_global_db=False,
+        return_dict=True,
+    ):
+        output = self.get_db(use_global_db).select_buckets(
+            c_f.hash_if_too_long(group_name),
+            series_name,
+            bucket_size,
+            experiment_name=experiment_name,
+            start_iteration=start_iteration,
+            end_iteration=end_iteration,
+        )
+        if return_dict:
+            return c_f.rows_to_dict(output)
+        return output
+
+    def changes_since(
+        self, cursor=None, use_global_db=False, return_dict=True, **kwargs
+    ):
+        changes, cursor = self.get_db(use_global_db).changes_since(cursor, **kwargs)
+        if return_dict:
+            changes = {k: c_f.rows_to_dict(v) for k, v in changes.items()}
+        return changes, cursor
+
+    def follow(self, cursor=None, use_global_db=False, return_dict=True, **kwargs):
+        for changes, cursor in self.get_db(use_global_db).follow(cursor, **kwargs):
+            if return_dict:
+                changes = {k: c_f.rows_to_dict(v) for k, v in changes.items()}
+            yield changes, cursor
+
     def table_exists(self, table_name, use_global_db=False):
+        table_name = c_f.hash_if_too_long(table_name)
         return self.get_db(use_global_db).table_exists(table_name)
+
+    def close(self):
+        try:
+            self.flush(wait=True)
+        finally:
+            if self.worker_is_running():
+                self.queue.put(None)
+                self.worker.join()
+            if self.spool is not None:
+                self.spool.close()
+            for sink in self.csv_sinks.values():
+                sink.close()
+            self.open_csv_sinks.clear()
+            self.local_db.close()
+            if self.global_db is not None:
+                self.global_db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,285 @@
+import bisect
+
+# Rollup tables hold count, sum, min, max and last of every numeric series,
+# per bucket of bucket_size iterations. There's one table per bucket size,
+# shared by every group, and DBManager.write updates them as rows are written.
+# Tables starting with _rk_ are internal, so they're not listed as groups.
+ROLLUP_PREFIX = "_rk_rollup_"
+# A rollup is only read if this table says it has every row of the table and
+# experiment (0 in a local db) from start_iteration on, where NULL means from
+# the first row. Otherwise the raw table is aggregated.
+COVERAGE_TABLE = "_rk_coverage"
+
+
+def get_rollup_table_name(bucket_size):
+    return "%s%d" % (ROLLUP_PREFIX, bucket_size)
+
+
+def is_number(x):
+    # NaN is skipped, since SQLite stores it as NULL
+    return isinstance(x, (int, float)) and x == x
+
+
+def get_runs(iterations, bucket_size):
+    # (bucket, start, end) for each bucket, if iterations are sorted
+    runs, start = [], 0
+    while start < len(iterations):
+        bucket = iterations[start] // bucket_size
+        end = bisect.bisect_left(iterations, (bucket + 1) * bucket_size, start)
+        runs.append((bucket, start, end))
+        start = end
+    return runs
+
+
+def aggregate(dict_of_lists, bucket_size):
+    # returns {(series_name, bucket): [count, sum, min, max, last, last_iteration]}
+    iterations = dict_of_lists["~iteration~"]
+    is_sorted = all(x <= y for x, y in zip(iterations, iterations[1:]))
+    runs = get_runs(iterations, bucket_size) if is_sorted else None
+    output = {}
+    for series_name, values in dict_of_lists.items():
+        if series_name == "~iteration~":
+            continue
+        # e.g. strings, lists and arrays
+        first = next((x for x in values if x is not None), None)
+        if not isinstance(first, (int, float)):
+            continue
+        if runs is not None and aggregate_runs(
+            output, series_name, values, iterations, runs
+        ):
+            continue
+        aggregate_values(output, series_name, values, iterations, bucket_size)
+    return output
+
+
+def aggregate_runs(output, series_name, values, iterations, runs):
+    # Uses the builtins on each bucket's slice of values, and returns False
+    # if the series has anything but numbers, e.g. None, NaN or arrays.
+    found = {}
+    for bucket, start, end in runs:
+        x = values[start:end]
+        try:
+            total = sum(x)
+        except TypeError:
+            return False
+        if not isinstance(total, (int, float)) or total != total:
+            return False
+        found[(series_name, bucket)] = [
+            len(x),
+            total,
+            min(x),
+            max(x),
+            x[-1],
+            iterations[end - 1],
+        ]
+    output.update(found)
+    return True
+
+
+def aggregate_values(output, series_name, values, iterations, bucket_size):
+    for iteration, x in zip(iterations, values):
+        if not is_number(x):
+            continue
+        key = (series_name, iteration // bucket_size)
+        y = output.get(key)
+        if y is None:
+            output[key] = [1, x, x, x, x, iteration]
+            continue
+        y[0] += 1
+        y[1] += x
+        if x < y[2]:
+            y[2] = x
+        elif x > y[3]:
+            y[3] = x
+        if iteration >= y[5]:
+            y[4], y[5] = x, iteration
+
+
+def coarsen(aggregates, bucket_size, new_bucket_size):
+    # combines the aggregates of smaller buckets, which is much cheaper
+    # than aggregating the rows again
+    factor = new_bucket_size // bucket_size
+    output = {}
+    for (series_name, bucket), x in aggregates.items():
+        key = (series_name, bucket // factor)
+        y = output.get(key)
+        if y is None:
+            output[key] = list(x)
+            continue
+        y[0] += x[0]
+        y[1] += x[1]
+        y[2] = min(y[2], x[2])
+        y[3] = max(y[3], x[3])
+        if x[5] >= y[5]:
+            y[4], y[5] = x[4], x[5]
+    return output
+
+
+def aggregate_all(dict_of_lists, bucket_sizes):
+    # returns {bucket_size: aggregates}, for bucket sizes in increasing order
+    output = {}
+    for bucket_size in bucket_sizes:
+        smaller = [x for x in output if bucket_size % x == 0]
+        if len(smaller) > 0:
+            x = max(smaller)
+            output[bucket_size] = coarsen(output[x], x, bucket_size)
+        else:
+            output[bucket_size] = aggregate(dict_of_lists, bucket_size)
+    return output
+
+
+def get_create_query(bucket_size, is_global):
+    # min, max, last and sum have no type, so integers stay integers
+    key = "table_name, series_name, bucket"
+    columns = "table_name text, series_name text, bucket integer, count integer, sum, min, max, last, last_iteration integer"
+    if is_global:
+        key = "experiment_id, %s" % key
+        columns = "experiment_id integer, %s" % columns
+    return "CREATE TABLE IF NOT EXISTS %s (%s, PRIMARY KEY (%s)) WITHOUT ROWID" % (
+        get_rollup_table_name(bucket_size),
+        columns,
+        key,
+    )
+
+
+def get_upsert_query(bucket_size, is_global):
+    columns = [
+        "table_name",
+        "series_name",
+        "bucket",
+        "count",
+        "sum",
+        "min",
+        "max",
+        "last",
+        "last_iteration",
+    ]
+    if is_global:
+        columns = ["experiment_id"] + columns
+    # the SET expressions all see the row's old values
+    return (
+        "INSERT INTO %s (%s) VALUES (%s) ON CONFLICT DO UPDATE SET "
+        "count = count + excluded.count, "
+        "sum = sum + excluded.sum, "
+        "min = MIN(min, excluded.min), "
+        "max = MAX(max, excluded.max), "
+        "last = CASE WHEN excluded.last_iteration >= last_iteration THEN excluded.last ELSE last END, "
+        "last_iteration = MAX(last_iteration, excluded.last_iteration)"
+    ) % (
+        get_rollup_table_name(bucket_size),
+        ", ".join(columns),
+        ", ".join(["?"] * len(columns)),
+    )
+
+
+def get_upsert_values(table_name, aggregates, experiment_id=None):
+    prefix = () if experiment_id is None else (experiment_id,)
+    return [
+        prefix + (table_name, series_name, bucket, *y)
+        for (series_name, bucket), y in aggregates.items()
+    ]
+
+
+def get_coverage_create_query():
+    return (
+        "CREATE TABLE IF NOT EXISTS %s (experiment_id integer, table_name text, "
+        "bucket_size integer, start_iteration integer, "
+        "PRIMARY KEY (experiment_id, table_name, bucket_size)) WITHOUT ROWID"
+    ) % COVERAGE_TABLE
+
+
+def is_covered(covered_from, start_iteration):
+    if covered_from is None:
+        return True
+    return start_iteration is not None and start_iteration >= covered_from
+
+
+def choose_bucket_size(available, bucket_size, start_iteration, end_iteration):
+    # The coarsest rollup whose buckets line up with the requested ones,
+    # or None if the raw table has to be aggregated.
+    def fits(x):
+        if bucket_size % x != 0:
+            return False
+        if start_iteration is not None and start_iteration % x != 0:
+            return False
+        return end_iteration is None or (end_iteration + 1) % x == 0
+
+    sizes = [x for x in available if fits(x)]
+    return max(sizes) if len(sizes) > 0 else None
+
+
+def get_buckets_query(
+    table_name,
+    series_name,
+    bucket_size,
+    rollup_size,
+    is_global,
+    experiment_name=None,
+    start_iteration=None,
+    end_iteration=None,
+):
+    # Both sources are turned into rows of (experiment_id, [~iteration~],
+    # count, sum, min, max, last, last_iteration), where [~iteration~] is the
+    # start of the requested bucket, and those rows are then combined.
+    conditions, values = [], []
+    experiment_id = "experiment_id" if is_global else "NULL"
+    if rollup_size is None:
+        x = "[%s]" % series_name
+        source = (
+            "SELECT %s AS experiment_id, [~iteration~] / %d * %d AS [~iteration~], "
+            "1 AS count, %s AS sum, %s AS min, %s AS max, %s AS last, "
+            "[~iteration~] AS last_iteration FROM %s"
+        ) % (experiment_id, bucket_size, bucket_size, x, x, x, x, table_name)
+        conditions.append("typeof(%s) IN ('integer', 'real')" % x)
+        iteration = "[~iteration~]"
+    else:
+        source = (
+            "SELECT %s AS experiment_id, bucket * %d / %d * %d AS [~iteration~], "
+            "count, sum, min, max, last, last_iteration FROM %s"
+        ) % (
+            experiment_id,
+            rollup_size,
+            bucket_size,
+            bucket_size,
+            get_rollup_table_name(rollup_size),
+        )
+        conditions += ["table_name = ?", "series_name = ?"]
+        values += [table_name, series_name]
+        # rollup_size divides the requested range, so buckets are never split
+        iteration = "bucket * %d" % rollup_size
+    if start_iteration is not None:
+        conditions.append("%s >= ?" % iteration)
+        values.append(start_iteration)
+    if end_iteration is not None:
+        conditions.append("%s <= ?" % iteration)
+        values.append(end_iteration)
+    if is_global and experiment_name is not None:
+        conditions.append(
+            "experiment_id = (SELECT id FROM experiment_ids WHERE experiment_name = ?)"
+        )
+        values.append(experiment_name)
+    if len(conditions) > 0:
+        source += " WHERE %s" % " AND ".join(conditions)
+
+    # the last value of each bucket comes from the row with the latest iteration
+    source = (
+        "SELECT *, LAST_VALUE(last) OVER (PARTITION BY experiment_id, [~iteration~] "
+        "ORDER BY last_iteration ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) "
+        "AS bucket_last FROM (%s)"
+    ) % source
+    query = (
+        "SELECT experiment_id, [~iteration~], SUM(count) AS count, "
+        "CAST(SUM(sum) AS REAL) / SUM(count) AS mean, MIN(min) AS min, "
+        "MAX(max) AS max, MAX(bucket_last) AS last FROM (%s) "
+        "GROUP BY experiment_id, [~iteration~]"
+    ) % source
+    columns = "g.[~iteration~], g.count, g.mean, g.min, g.max, g.last"
+    if is_global:
+        query = (
+            "SELECT e.experiment_name, %s FROM (%s) AS g "
+            "JOIN experiment_ids AS e ON g.experiment_id = e.id "
+            "ORDER BY g.experiment_id, g.[~iteration~]"
+        ) % (columns, query)
+    else:
+        query = "SELECT %s FROM (%s) AS g ORDER BY g.[~iteration~]" % (columns, query)
+    return query, values
@@ -0,0 +1,146 @@
+import copy
+import fnmatch
+import random
+import time
+
+from . import utils as c_f
+
+# Each policy receives every value of one series through add(),
+# and returns the (series_suffix, value, iteration) tuples to record.
+# RecordKeeper gives each matching series its own copy of the policy.
+
+
+class EveryN:
+    def __init__(self, n):
+        self.n = n
+        self.count = 0
+
+    def add(self, value, iteration):
+        keep = self.count % self.n == 0
+        self.count += 1
+        return [("", value, iteration)] if keep else []
+
+    def flush(self):
+        return []
+
+
+class EveryNSeconds:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.last_time = None
+
+    def add(self, value, iteration):
+        now = time.monotonic()
+        if self.last_time is not None and now - self.last_time < self.seconds:
+            return []
+        self.last_time = now
+        return [("", value, iteration)]
+
+    def flush(self):
+        return []
+
+
+class WindowReduce:
+    # Emits one value per reduction for every "window" numeric values,
+    # at the iteration of the window's last value.
+    # Non-numeric values (strings, lists, arrays) are passed through.
+    reduction_functions = {
+        "mean": lambda x: sum(x) / len(x),
+        "min": min,
+        "max": max,
+        "last": lambda x: x[-1],
+    }
+
+    def __init__(self, window, reductions=("mean",)):
+        self.window = window
+        self.names = [reductions] if isinstance(reductions, str) else list(reductions)
+        self.values = []
+        self.last_iteration = None
+
+    def add(self, value, iteration):
+        # only single values are converted, so lists, arrays
+        # and tensors with more than one element are passed through
+        if not c_f.is_list_and_has_more_than_one_element(value):
+            value = c_f.convert_to_scalar(value)
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            return [("", value, iteration)]
+        self.values.append(value)
+        self.last_iteration = iteration
+        if len(self.values) < self.window:
+            return []
+        return self.flush()
+
+    def flush(self):
+        if len(self.values) == 0:
+            return []
+        single = len(self.names) == 1
+        output = [
+            (
+                "" if single else "_%s" % k,
+                self.reduction_functions[k](self.values),
+                self.last_iteration,
+            )
+            for k in self.names
+        ]
+        self.values = []
+        return output
+
+
+class Reservoir:
+    # Keeps k uniformly sampled values out of every "window" values,
+    # and emits them in iteration order when the window is full.
+    def __init__(self, window, k, seed=None):
+        self.window = window
+        self.k = k
+        self.rng = random.Random(seed)
+        self.count = 0
+        self.samples = []
+
+    def add(self, value, iteration):
+        self.count += 1
+        if len(self.samples) < self.k:
+            self.samples.append((iteration, value))
+        else:
+            i = self.rng.randrange(self.count)
+            if i < self.k:
+                self.samples[i] = (iteration, value)
+        if self.count < self.window:
+            return []
+        return self.flush()
+
+    def flush(self):
+        output = [("", v, i) for i, v in sorted(self.samples, key=lambda x: x[0])]
+        self.samples = []
+        self.count = 0
+        return output
+
+
+class SamplingPolicies:
+    # Maps "group/series" names to policies with fnmatch patterns.
+    # The first matching pattern wins.
+    def __init__(self, policies):
+        self.policies = list(
+            policies.items() if isinstance(policies, dict) else policies
+        )
+        self.states = {}
+
+    def get(self, group_name, series_name, full_group_name=None):
+        key = (group_name, series_name)
+        try:
+            return self.states[key]
+        except KeyError:
+            pass
+        name = "%s/%s" % (full_group_name or group_name, series_name)
+        state = None
+        for pattern, policy in self.policies:
+            if fnmatch.fnmatchcase(name, pattern):
+                state = copy.deepcopy(policy)
+                break
+        self.states[key] = state
+        return state
+
+    def flush(self):
+        for (group_name, series_name), state in self.states.items():
+            if state is not None:
+                for suffix, value, iteration in state.flush():
+                    yield group_name, series_name + suffix, value, iteration
@@ -0,0 +1,415 @@
+import concurrent.futures
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from . import utils as c_f
+from .db_utils import DBManager
+
+
+def is_missing_table_or_column(e):
+    message = str(e)
+    return message.startswith("no such table") or message.startswith("no such column")
+
+
+def get_shard_name(shard):
+    return os.path.splitext(os.path.basename(shard.db_path))[0]
+
+
+class ShardedDBManager:
+    # A global database split across files in one folder, so that experiments
+    # don't all wait on one write lock. With num_shards=None every experiment
+    # gets its own file, otherwise experiments are hashed into num_shards files.
+    # catalog.db maps experiment names to ids and shard files. Each shard is a
+    # regular global database, so it can also be opened with DBManager.
+    def __init__(self, folder, num_shards=None, max_workers=None, **db_kwargs):
+        self.folder = folder
+        self.num_shards = num_shards
+        self.max_workers = max_workers
+        self.db_kwargs = db_kwargs
+        c_f.makedir_if_not_there(self.folder)
+        self.catalog = DBManager(os.path.join(self.folder, "catalog.db"), **db_kwargs)
+        self.catalog.execute(
+            "CREATE TABLE IF NOT EXISTS experiments (id integer primary key autoincrement, experiment_name text unique, has_records integer, shard text)"
+        )
+        self.shards = {}
+        self.shards_lock = threading.Lock()
+        self.experiment_shards = {}
+        self.experiments_with_records = set()
+        self.executor = None
+        self.local = threading.local()
+
+    def get_shard_name(self, experiment_id, experiment_name):
+        if self.num_shards is None:
+            return "experiment_%d" % experiment_id
+        bucket = zlib.crc32(experiment_name.encode("utf8")) % self.num_shards
+        return "shard_%d" % bucket
+
+    def new_experiment(self, experiment_name):
+        if not self.experiment_name_has_records(experiment_name):
+            self.purge_experiment(experiment_name)
+        with self.catalog.transaction():
+            self.catalog.execute(
+                "INSERT INTO experiments (experiment_name, has_records) values (?, ?)",
+                (experiment_name, int(False)),
+            )
+            experiment_id = self.get_experiment_id(experiment_name)
+            shard_name = self.get_shard_name(experiment_id, experiment_name)
+            self.catalog.execute(
+                "UPDATE experiments SET shard=? WHERE id=?", (shard_name, experiment_id)
+            )
+        self.get_shard(shard_name).new_experiment(experiment_name, experiment_id)
+        self.experiment_shards[experiment_name] = shard_name
+        self.experiments_with_records.discard(experiment_name)
+
+    def delete_experiment(self, experiment_name):
+        shard_name = self.get_experiment_shard_name(experiment_name)
+        self.catalog.execute(
+            "DELETE FROM experiments WHERE experiment_name=?", (experiment_name,)
+        )
+        if shard_name is not None and os.path.isfile(
+            os.path.join(self.folder, shard_name + ".db")
+        ):
+            self.get_shard(shard_name).delete_experiment(experiment_name)
+        self.experiment_shards.pop(experiment_name, None)
+
+    def purge_experiment(self, experiment_name):
+        shard_name = self.get_experiment_shard_name(experiment_name)
+        num_rows = 0
+        if shard_name is not None:
+            shard = self.get_shard(shard_name)
+            num_rows = shard.purge_experiment(experiment_name)
+            if self.num_shards is None:
+                # the shard only had this experiment
+                with self.shards_lock:
+                    self.shards.pop(shard_name).close()
+                for suffix in ["", "-wal", "-shm"]:
+                    if os.path.isfile(shard.db_path + suffix):
+                        os.remove(shard.db_path + suffix)
+        self.delete_experiment(experiment_name)
+        self.experiments_with_records.discard(experiment_name)
+        return num_rows
+
+    def compact(self, incremental=True):
+        output = self.catalog.compact(incremental)
+        for shard in self.get_all_shards():
+            for k, v in shard.compact(incremental).items():
+                output[k] += v
+        return output
+
+    def experiment_name_has_records(self, experiment_name):
+        has_records = self.catalog.execute(
+            "SELECT has_records FROM experiments WHERE experiment_name=?",
+            (experiment_name,),
+            fetch=True,
+        )
+        if len(has_records) > 0:
+            return bool(has_records[0]["has_records"])
+        return False
+
+    def get_experiment_id(self, experiment_name):
+        output = self.catalog.execute(
+            "SELECT id FROM experiments WHERE experiment_name=?",
+            (experiment_name,),
+            fetch=True,
+        )
+        return output[0]["id"]
+
+    def set_has_records(self, experiment_name):
+        # the catalog is shared by every writer, so only update it once
+        if experiment_name in self.experiments_with_records:
+            return
+        self.catalog.execute(
+            "UPDATE experiments SET has_records=? WHERE experiment_name=?",
+            (int(True), experiment_name),
+        )
+        self.get_experiment_shard(experiment_name).set_has_records(experiment_name)
+        self.experiments_with_records.add(experiment_name)
+
+    def get_experiment_shard_name(self, experiment_name):
+        shard_name = self.experiment_shards.get(experiment_name)
+        if shard_name is None:
+            output = self.catalog.execute(
+                "SELECT shard FROM experiments WHERE experiment_name=?",
+                (experiment_name,),
+                fetch=True,
+            )
+            if len(output) == 0:
+                return None
+            shard_name = self.experiment_shards[experiment_name] = output[0]["shard"]
+        return shard_name
+
+    def get_experiment_shard(self, experiment_name):
+        shard_name = self.get_experiment_shard_name(experiment_name)
+        if shard_name is None:
+            raise ValueError("experiment %s does not exist" % experiment_name)
+        return self.get_shard(shard_name)
+
+    def get_shard(self, shard_name):
+        with self.shards_lock:
+            shard = self.shards.get(shard_name)
+            if shard is None:
+                shard = self.shards[shard_name] = DBManager(
+                    os.path.join(self.folder, shard_name + ".db"),
+                    is_global=True,
+                    **self.db_kwargs
+                )
+        return shard
+
+    def get_all_shards(self, experiment_name=None):
+        if experiment_name is not None:
+            shard_name = self.get_experiment_shard_name(experiment_name)
+            return [] if shard_name is None else [self.get_shard(shard_name)]
+        # in order of their first experiment
+        shard_names = self.catalog.execute(
+            "SELECT shard FROM experiments WHERE shard IS NOT NULL GROUP BY shard ORDER BY MIN(id)",
+            fetch=True,
+        )
+        return [self.get_shard(x["shard"]) for x in shard_names]
+
+    def write(
+        self, table_name, dict_of_lists, experiment_name=None, update_has_records=True
+    ):
+        assert experiment_name is not None
+        shard = self.get_experiment_shard(experiment_name)
+        stack = getattr(self.local, "transaction", None)
+        if stack is not None and shard not in self.local.transaction_shards:
+            stack.enter_context(shard.transaction())
+            self.local.transaction_shards.add(shard)
+        shard.write(
+            table_name,
+            dict_of_lists,
+            experiment_name=experiment_name,
+            update_has_records=False,
+        )
+        if update_has_records:
+            self.set_has_records(experiment_name)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        # opens a transaction on each shard the first time it's written to
+        if getattr(self.local, "transaction", None) is not None:
+            yield
+            return
+        with contextlib.ExitStack() as stack:
+            self.local.transaction = stack
+            self.local.transaction_shards = set()
+            try:
+                yield
+            finally:
+                self.local.transaction = None
+                self.local.transaction_shards = None
+
+    def map_shards(self, fn, shards):
+        if len(shards) <= 1:
+            return [fn(x) for x in shards]
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(self.max_workers)
+        return list(self.executor.map(fn, shards))
+
+    def run_on_shards(self, fn, shards, errors):
+        # Shards without the table or column have nothing to return.
+        # If every shard fails, the first error is raised.
+        def run(shard):
+            try:
+                return fn(shard)
+            except errors as e:
+                if isinstance(e, sqlite3.OperationalError):
+                    if not is_missing_table_or_column(e):
+                        raise
+                return e
+
+        results = self.map_shards(run, shards)
+        found = [x for x in results if not isinstance(x, Exception)]
+        if len(found) == 0 and len(results) > 0:
+            raise results[0]
+        return found
+
+    def query(self, query, values=()):
+        # Results are concatenated in shard order,
+        # so ORDER BY, LIMIT and aggregates apply to each shard separately.
+        results = self.run_on_shards(
+            lambda x: x.query(query, values),
+            self.get_all_shards(),
+            sqlite3.OperationalError,
+        )
+        return self.merge_rows(results)
+
+    def select(self, table_name, *args, experiment_name=None, **kwargs):
+        shards = self.get_all_shards(experiment_name)
+        self.check_columns(table_name, shards, *args, **kwargs)
+        results = self.run_on_shards(
+            lambda x: x.select(
+                table_name,
+                *args,
+                experiment_name=experiment_name,
+                fill_missing=True,
+                **kwargs
+            ),
+            shards,
+            ValueError,
+        )
+        return self.merge_rows(results)
+
+    def select_buckets(self, table_name, *args, experiment_name=None, **kwargs):
+        # experiments are never split across shards, so neither are buckets
+        results = self.run_on_shards(
+            lambda x: x.select_buckets(
+                table_name, *args, experiment_name=experiment_name, **kwargs
+            ),
+            self.get_all_shards(experiment_name),
+            sqlite3.OperationalError,
+        )
+        return self.merge_rows(results)
+
+    def changes_since(self, cursor=None, table_names=None, limit=None):
+        # Ids are only unique within a shard, so the cursor is a dict of
+        # shard name -> that shard's cursor. limit applies per shard.
+        cursor = {} if cursor is None else dict(cursor)
+        results = []
+        for shard in self.get_all_shards():
+            shard_name = get_shard_name(shard)
+            changes, cursor[shard_name] = shard.changes_since(
+                cursor.get(shard_name), table_names, limit
+            )
+            results.append(changes)
+        return self.merge_changes(results), cursor
+
+    def follow(self, cursor=None, table_names=None, interval=1.0, timeout=None):
+        # Like DBManager.follow, with one connection per shard,
+        # so only the shards that something was written to are queried.
+        cursor = {} if cursor is None else dict(cursor)
+        conns, versions = {}, {}
+        try:
+            last_change = time.monotonic()
+            while True:
+                results = []
+                for shard in self.get_all_shards():
+                    shard_name = get_shard_name(shard)
+                    conn = conns.get(shard_name)
+                    if conn is None:
+                        conn = conns[shard_name] = shard.connect()
+                    version = conn.execute("PRAGMA data_version").fetchone()[0]
+                    if version == versions.get(shard_name):
+                        continue
+                    versions[shard_name] = version
+                    changes, cursor[shard_name] = shard.changes_since(
+                        cursor.get(shard_name), table_names, conn=conn
+                    )
+                    results.append(changes)
+                changes = self.merge_changes(results)
+                if len(changes) > 0:
+                    yield changes, dict(cursor)
+                    last_change = time.monotonic()
+                    continue
+                if timeout is not None and time.monotonic() - last_change >= timeout:
+                    return
+                time.sleep(interval)
+        finally:
+            for conn in conns.values():
+                conn.close()
+
+    def merge_changes(self, results):
+        tables = {}
+        for changes in results:
+            for table_name, rows in changes.items():
+                tables.setdefault(table_name, []).append(rows)
+        return {k: self.merge_rows(v) for k, v in tables.items()}
+
+    def merge_rows(self, results):
+        results = [x for x in results if len(x) > 0]
+        keys = [tuple(x[0].keys()) for x in results]
+        if len(set(keys)) <= 1:
+            return [row for x in results for row in x]
+        # shards with different columns, so fill in the missing ones
+        all_keys = list(dict.fromkeys(k for x in keys for k in x))
+        return [
+            {k: row[k] if k in shard_keys else None for k in all_keys}
+            for x, shard_keys in zip(results, keys)
+            for row in x
+        ]
+
+    def iter_query(self, query, values=(), chunk_size=65536):
+        return self.iter_shards(
+            lambda x: x.iter_query(query, values, chunk_size),
+            self.get_all_shards(),
+            sqlite3.OperationalError,
+        )
+
+    def iter_select(self, table_name, *args, experiment_name=None, **kwargs):
+        shards = self.get_all_shards(experiment_name)
+        self.check_columns(table_name, shards, *args, **kwargs)
+        return self.iter_shards(
+            lambda x: x.iter_select(
+                table_name,
+                *args,
+                experiment_name=experiment_name,
+                fill_missing=True,
+                **kwargs
+            ),
+            shards,
+            ValueError,
+        )
+
+    def iter_shards(self, fn, shards, errors):
+        # one shard at a time, so only one chunk is in memory
+        found, first_error = False, None
+        for shard in shards:
+            try:
+                yield from fn(shard)
+                found = True
+            except errors as e:
+                if isinstance(e, sqlite3.OperationalError):
+                    if not is_missing_table_or_column(e):
+                        raise
+                first_error = first_error or e
+        if not found and first_error is not None:
+            raise first_error
+
+    def check_columns(self, table_name, shards, columns=None, *args, **kwargs):
+        if columns is None:
+            return
+        schema = set()
+        for shard in shards:
+            schema.update(shard.get_schema(table_name, refresh=True))
+        for x in columns:
+            if "[{}]".format(x) not in schema:
+                raise ValueError("table %s has no column %s" % (table_name, x))
+
+    def write_full_names(self, full_names):
+        self.catalog.write_full_names(full_names)
+
+    def get_full_name(self, table_name):
+        return self.catalog.get_full_name(table_name)
+
+    def table_exists(self, table_name):
+        return any(x.table_exists(table_name) for x in self.get_all_shards())
+
+    def get_table_names(self):
+        table_names = {}
+        for shard in self.get_all_shards():
+            table_names.update(dict.fromkeys(shard.get_table_names()))
+        return list(table_names)
+
+    def create_all_indexes(self):
+        for shard in self.get_all_shards():
+            shard.create_all_indexes()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        self.catalog.close()
+        with self.shards_lock:
+            shards = list(self.shards.values())
+        for shard in shards:
+            shard.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,83 @@
+import glob
+import os
+import pickle
+import struct
+import time
+import zlib
+
+# Each record is stored as length, crc32, then the pickled record.
+RECORD_HEADER = struct.Struct("<II")
+
+
+class Spool:
+    # An append-only log of the records that haven't been saved yet, so they
+    # survive the process being killed. Every record is handed to the OS when
+    # it's appended, but fsync only runs every sync_interval seconds, which is
+    # what a power loss or OS crash would need. Each save starts a new segment
+    # file, and a segment is deleted once its records are in the dbs and CSVs.
+    def __init__(self, folder, sync_interval=1.0):
+        self.folder = folder
+        self.sync_interval = sync_interval
+        self.file = None
+        self.last_sync = time.monotonic()
+        segments = self.get_segments()
+        self.next_segment = get_segment_number(segments[-1]) + 1 if segments else 0
+
+    def get_segments(self):
+        return sorted(
+            glob.glob(os.path.join(self.folder, "spool_*.bin")),
+            key=get_segment_number,
+        )
+
+    def append(self, record):
+        if self.file is None:
+            filename = os.path.join(self.folder, "spool_%d.bin" % self.next_segment)
+            self.next_segment += 1
+            # unbuffered, so each record is one write call
+            self.file = open(filename, "ab", buffering=0)
+        data = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        self.file.write(RECORD_HEADER.pack(len(data), zlib.crc32(data)) + data)
+        if time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        if self.file is not None:
+            os.fsync(self.file.fileno())
+        self.last_sync = time.monotonic()
+
+    def rotate(self):
+        # closes the current segment and returns it, or None if it's empty
+        if self.file is None:
+            return None
+        filename = self.file.name
+        self.file.close()
+        self.file = None
+        return filename
+
+    def delete(self, filename):
+        if filename is not None and os.path.isfile(filename):
+            os.remove(filename)
+
+    def close(self):
+        self.rotate()
+
+
+def get_segment_number(filename):
+    return int(os.path.basename(filename)[len("spool_") : -len(".bin")])
+
+
+def read_segment(filename):
+    # stops at the first incomplete or corrupted record,
+    # e.g. one that was being written when the process died
+    records = []
+    with open(filename, "rb") as f:
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                break
+            size, crc = RECORD_HEADER.unpack(header)
+            data = f.read(size)
+            if len(data) < size or zlib.crc32(data) != crc:
+                break
+            records.append(pickle.loads(data))
+    return records
@@ -0,0 +1,131 @@
+import collections
+import contextlib
+import threading
+import time
+
+
+class Histogram:
+    # Latencies in power-of-two buckets of microseconds,
+    # so recording is O(1) and memory doesn't grow.
+    num_buckets = 40
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * self.num_buckets
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        i = min(int(seconds * 1e6).bit_length(), self.num_buckets - 1)
+        self.buckets[i] += 1
+
+    def percentile(self, q):
+        # the upper bound of the bucket that contains the q-th percentile
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target and n > 0:
+                return min(2**i / 1e6, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total_ms": self.total * 1000,
+            "mean_ms": self.total / self.count * 1000 if self.count > 0 else 0.0,
+            "p50_ms": self.percentile(0.5) * 1000,
+            "p99_ms": self.percentile(0.99) * 1000,
+            "max_ms": self.max * 1000,
+        }
+
+
+class Timer:
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *args):
+        self.stats.record(self.name, time.perf_counter() - self.start)
+
+
+class Stats:
+    # Counters and latency histograms, keyed by names like "csv_write"
+    # or "rows/<group_name>". Safe to update from the async writer thread.
+    enabled = True
+
+    def __init__(self):
+        self.counters = collections.Counter()
+        self.timers = collections.defaultdict(Histogram)
+        self.lock = threading.Lock()
+
+    def add(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def record(self, name, seconds):
+        with self.lock:
+            self.timers[name].add(seconds)
+
+    def time(self, name):
+        return Timer(self, name)
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "counters": dict(self.counters),
+                "timers": {k: v.to_dict() for k, v in self.timers.items()},
+            }
+
+    def to_flat_dict(self):
+        # one number per key, e.g. for logging
+        stats = self.to_dict()
+        output = dict(stats["counters"])
+        for k, v in stats["timers"].items():
+            for x in ["count", "mean_ms", "p99_ms", "max_ms"]:
+                output["%s/%s" % (k, x)] = v[x]
+        return output
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.timers.clear()
+
+
+class NullStats:
+    # used when stats are off, so instrumented code doesn't need to check
+    enabled = False
+
+    def add(self, name, value=1):
+        pass
+
+    def record(self, name, seconds):
+        pass
+
+    def time(self, name):
+        return contextlib.nullcontext()
+
+    def to_dict(self):
+        return {"counters": {}, "timers": {}}
+
+    def to_flat_dict(self):
+        return {}
+
+    def reset(self):
+        pass
+
+
+def get_stats(stats):
+    # True for a new Stats object, or an existing one to share it
+    if stats is True:
+        return Stats()
+    if not stats:
+        return NullStats()
+    return stats
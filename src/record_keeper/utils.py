@@ -1,13 +1,17 @@
+import collections
 import csv
 import errno
+import functools
 import hashlib
 import json
 import os
 import pickle
+import sys
 from collections.abc import Sized
 
-import numpy as np
-import torch
+# numpy and torch are imported only by the functions that need them.
+# Type checks look them up in sys.modules instead, because a value can't
+# be an array or tensor unless its module has already been imported.
 
 
 def save_pkl(obj, filename, protocol=None):
@@ -29,13 +33,7 @@ def write_dict_of_lists_to_csv(obj, filename, append=False):
     if append:
         open_as = "a"
         if os.path.isfile(filename):
-            with open(filename, "r") as f:
-                reader = csv.reader(f)
-                all_header_rows = list(reader)
-                for row in all_header_rows[::-1]:
-                    if len(row) > 0 and row[0] == "~iteration~":
-                        write_header = row != list(obj.keys())
-                        break
+            write_header = get_last_csv_header(filename) != list(obj.keys())
 
     # https://stackoverflow.com/a/23613603
     with open(filename, open_as) as outfile:
@@ -45,6 +43,26 @@ def write_dict_of_lists_to_csv(obj, filename, append=False):
         writer.writerows(zip(*obj.values()))
 
 
+def get_last_csv_header(filename, block_size=65536):
+    # Reads backwards from the end of the file,
+    # so the cost doesn't grow with the number of rows.
+    marker = b"~iteration~"
+    with open(filename, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        partial_line = b""
+        while end > 0:
+            start = max(0, end - block_size)
+            f.seek(start)
+            lines = (f.read(end - start) + partial_line).split(b"\n")
+            # the first line might continue in the previous block
+            partial_line = lines.pop(0) if start > 0 else b""
+            for line in reversed(lines):
+                if line.startswith(marker):
+                    return next(csv.reader([line.decode("utf8").rstrip("\r")]))
+            end = start
+    return None
+
+
 # https://stackoverflow.com/a/8685873
 def write_dict_to_json(obj, filename):
     with open(filename, "w") as f:
@@ -57,13 +75,43 @@ def convert_to_scalar(v):
     except AttributeError:
         try:
             output = v[0]  # list or numpy
-            if isinstance(output, (np.int32, np.int64)):
+            np = sys.modules.get("numpy")
+            if np is not None and isinstance(output, (np.int32, np.int64)):
                 output = int(output)
             return output
         except (TypeError, IndexError):
             return v  # already a scalar
 
 
+def convert_tensors(tensors):
+    # One device-to-host copy per (device, dtype, is scalar),
+    # instead of one sync per tensor.
+    import torch
+
+    output = [None] * len(tensors)
+    batches = collections.defaultdict(list)
+    for i, t in enumerate(tensors):
+        batches[(t.device, t.dtype, t.dim() == 0)].append(i)
+    for (_, _, is_scalar), idx in batches.items():
+        if is_scalar:
+            values = torch.stack([tensors[i].detach() for i in idx]).cpu().tolist()
+            for i, x in zip(idx, values):
+                output[i] = x
+            continue
+        flat = torch.cat([tensors[i].detach().reshape(-1) for i in idx]).cpu()
+        # numpy views, so RecordWriter copies them into its 2-d blocks
+        flat = convert_to_numpy(flat)
+        offset = 0
+        for i in idx:
+            n = tensors[i].nelement()
+            if n == 1:
+                output[i] = flat[offset].item()
+            else:
+                output[i] = flat[offset : offset + n].reshape(tensors[i].shape)
+            offset += n
+    return output
+
+
 def convert_to_list(v):
     try:
         return v.detach().tolist()  # pytorch
@@ -74,6 +122,51 @@ def convert_to_list(v):
             return [v]  # already a scalar
 
 
+def convert_to_numpy(v):
+    try:
+        v = v.detach().cpu()  # pytorch
+    except AttributeError:
+        import numpy as np
+
+        return np.asarray(v)
+    try:
+        return v.numpy()
+    except TypeError:
+        return v.float().numpy()  # e.g. bfloat16, which numpy doesn't have
+
+
+class JSONList(str):
+    # A list that's already JSON-encoded. It's written as is to CSV files,
+    # and to json columns, so the values are only formatted once.
+    pass
+
+
+def has_arrays(values):
+    for x in values:
+        if x is not None:
+            return is_array(x)
+    return False
+
+
+def has_object_arrays(values):
+    # arrays of python objects hold pointers, so they can't be saved as bytes
+    return any(is_array(x) and x.dtype.hasobject for x in values)
+
+
+def encode_arrays(values):
+    # Numeric arrays become JSONLists, which match the CSV text of the
+    # equivalent lists, except that NaN and infinity are spelled like JSON.
+    output = []
+    for x in values:
+        if is_array(x):
+            if x.dtype.kind in "iuf":
+                x = JSONList(json.dumps(x.tolist()))
+            else:
+                x = x.tolist()
+        output.append(x)
+    return output
+
+
 def try_get_len(v):
     try:
         return len(v)  # most things
@@ -114,10 +207,35 @@ def unneeded_descriptors():
     return ["ModuleDict", "ModuleList"]
 
 
+def is_tensor(x):
+    torch = sys.modules.get("torch")
+    return torch is not None and isinstance(x, torch.Tensor)
+
+
+def is_array(x):
+    np = sys.modules.get("numpy")
+    return np is not None and isinstance(x, np.ndarray)
+
+
+PRIMITIVE_TYPES = {}
+
+
+def get_primitive_types():
+    key = ("numpy" in sys.modules, "torch" in sys.modules)
+    types = PRIMITIVE_TYPES.get(key)
+    if types is None:
+        types = (int, float, str, bool, list)
+        if key[0]:
+            np = sys.modules["numpy"]
+            types += (np.int32, np.int64, np.ndarray)
+        if key[1]:
+            types += (sys.modules["torch"].Tensor,)
+        PRIMITIVE_TYPES[key] = types
+    return types
+
+
 def is_primitive(x):
-    return isinstance(
-        x, (int, float, str, bool, list, np.int32, np.int64, np.ndarray, torch.Tensor)
-    )
+    return isinstance(x, get_primitive_types())
 
 
 def separate_iterations_from_series(records):
@@ -137,6 +255,108 @@ def separate_iterations_from_series(records):
     return output
 
 
+def rows_to_dict(rows):
+    if len(rows) > 0:
+        return {k: [row[k] for row in rows] for k in rows[0].keys()}
+    return {}
+
+
+def rows_to_arrays(column_names, rows):
+    return {k: list_to_array(v) for k, v in zip(column_names, zip(*rows))}
+
+
+def chunks_to_arrays(chunks):
+    # concatenates (column_names, rows) chunks into one array per column,
+    # where columns missing from a chunk are NULL
+    arrays, length = {}, 0
+    for column_names, rows in chunks:
+        for k, v in rows_to_arrays(column_names, rows).items():
+            if k not in arrays:
+                arrays[k] = [list_to_array([None] * length)] if length > 0 else []
+            arrays[k].append(v)
+        for k, v in arrays.items():
+            if k not in column_names:
+                v.append(list_to_array([None] * len(rows)))
+        length += len(rows)
+    return {k: concatenate_arrays(v) for k, v in arrays.items()}
+
+
+def list_to_array(values):
+    import numpy as np
+
+    # ints -> int64 (masked where NULL), floats -> float64 (nan where NULL),
+    # anything else -> object
+    types = set(map(type, values))
+    has_null = type(None) in types
+    types.discard(type(None))
+    if types <= {int}:
+        try:
+            if not has_null:
+                return np.array(values, dtype=np.int64)
+            mask = np.array([v is None for v in values])
+            data = np.array([0 if v is None else v for v in values], dtype=np.int64)
+            return np.ma.masked_array(data, mask=mask)
+        except OverflowError:
+            pass
+    elif types <= {int, float}:
+        return np.array(values, dtype=np.float64)
+    elif types == {np.ndarray} and not has_null:
+        if len({(v.dtype, v.shape) for v in values}) == 1:
+            return np.stack(values)
+    output = np.empty(len(values), dtype=object)
+    try:
+        output[:] = values
+    except ValueError:
+        # values that numpy would treat as a dimension, like lists
+        for i, v in enumerate(values):
+            output[i] = v
+    return output
+
+
+def concatenate_arrays(arrays):
+    import numpy as np
+
+    if len(arrays) == 1:
+        return arrays[0]
+    kinds = {a.dtype.kind for a in arrays}
+    if len({a.shape[1:] for a in arrays}) > 1:
+        # stacked array values whose shape changed between chunks
+        arrays = [a if a.ndim == 1 else rows_to_object(a) for a in arrays]
+        kinds.add("O")
+    if "O" in kinds:
+        arrays = [masked_to_object(a) for a in arrays]
+        return np.concatenate(arrays)
+    if "f" in kinds:
+        arrays = [
+            a.astype(np.float64).filled(np.nan) if np.ma.isMaskedArray(a) else a
+            for a in arrays
+        ]
+        return np.concatenate(arrays)
+    if any(np.ma.isMaskedArray(a) for a in arrays):
+        return np.ma.concatenate(arrays)
+    return np.concatenate(arrays)
+
+
+def rows_to_object(a):
+    import numpy as np
+
+    output = np.empty(len(a), dtype=object)
+    for i, v in enumerate(a):
+        output[i] = v
+    return output
+
+
+def masked_to_object(a):
+    import numpy as np
+
+    output = np.asarray(a, dtype=object).copy()
+    if np.ma.isMaskedArray(a):
+        output[np.ma.getmaskarray(a)] = None
+    return output
+
+
+# cached, because it's called for every recorded value
+@functools.lru_cache(maxsize=4096)
 def hash_if_too_long(x):
     y = x.split("_")
     if len(y) <= 2:
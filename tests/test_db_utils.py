@@ -0,0 +1,196 @@
+import os
+import shutil
+import threading
+import unittest
+
+from record_keeper.db_utils import DBManager
+
+FOLDER = "test_folder_db_utils"
+
+
+class TestDBManager(unittest.TestCase):
+    def setUp(self):
+        os.makedirs(FOLDER, exist_ok=True)
+        self.db_path = os.path.join(FOLDER, "logs.db")
+
+    def tearDown(self):
+        shutil.rmtree(FOLDER)
+
+    def test_persistent_connection(self):
+        with DBManager(self.db_path, persistent=True) as db:
+            db.write("stuff", {"~iteration~": [0, 1], "A": [1.5, 2.5]})
+            conn = db.get_connection()
+            db.write("stuff", {"~iteration~": [2], "A": [3.5]})
+            self.assertTrue(db.get_connection() is conn)
+
+            other_conns = []
+            t = threading.Thread(target=lambda: other_conns.append(db.get_connection()))
+            t.start()
+            t.join()
+            self.assertTrue(other_conns[0] is not conn)
+            self.assertTrue(len(db.connections) == 2)
+
+            result = db.query("SELECT A FROM stuff")
+            self.assertTrue([x["A"] for x in result] == [1.5, 2.5, 3.5])
+
+        self.assertTrue(len(db.connections) == 0)
+        # reopens transparently after close
+        self.assertTrue(len(db.query("SELECT A FROM stuff")) == 3)
+        db.close()
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires os.fork")
+    def test_persistent_connection_after_fork(self):
+        db = DBManager(self.db_path, persistent=True)
+        db.write("stuff", {"~iteration~": [0], "A": [1]})
+        parent_conn = db.get_connection()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                ok = db.get_connection() is not parent_conn
+                db.write("stuff", {"~iteration~": [1], "A": [2]})
+                db.close()
+            except Exception:
+                ok = False
+            os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertTrue(os.WEXITSTATUS(status) == 0)
+        self.assertTrue(db.get_connection() is parent_conn)
+        result = db.query("SELECT A FROM stuff")
+        self.assertTrue([x["A"] for x in result] == [1, 2])
+        db.close()
+
+    def test_wal_pragma_profile(self):
+        db = DBManager(
+            self.db_path,
+            is_global=True,
+            persistent=True,
+            pragmas="wal",
+            checkpoint_interval=0,
+        )
+        self.assertTrue(db.query("PRAGMA journal_mode")[0][0] == "wal")
+        self.assertTrue(db.query("PRAGMA synchronous")[0][0] == 1)
+        self.assertTrue(db.query("PRAGMA busy_timeout")[0][0] == 60000)
+        db.new_experiment("test")
+        db.write("stuff", {"~iteration~": [0, 1], "A": [1, 2]}, experiment_name="test")
+
+        # a reader can query while a write transaction is open
+        reader = DBManager(self.db_path, pragmas={"busy_timeout": 0})
+        with db.transaction():
+            db.write("stuff", {"~iteration~": [2], "A": [3]}, experiment_name="test")
+            self.assertTrue(len(reader.query("SELECT A FROM stuff")) == 2)
+        self.assertTrue(len(reader.query("SELECT A FROM stuff")) == 3)
+        self.assertTrue(db.checkpoint("TRUNCATE")[0] == 0)
+        db.close()
+
+    def test_schema_cache(self):
+        db1 = DBManager(self.db_path)
+        db2 = DBManager(self.db_path)
+        db1.write("stuff", {"~iteration~": [0], "A": [1]})
+        self.assertTrue(list(db1.schemas["stuff"]) == ["[id]", "[~iteration~]", "[A]"])
+
+        statements = []
+        db1.connect = wrap_connect(db1.connect, statements)
+        db1.write("stuff", {"~iteration~": [1], "A": [2]})
+        self.assertTrue(len(statements) == 1)
+        self.assertTrue(statements[0].startswith("INSERT"))
+
+        # another process adds columns behind db1's back
+        db2.write("stuff", {"~iteration~": [2], "B": ["x"]})
+        db2.write("stuff", {"~iteration~": [3], "C": [[1, 2]]})
+        statements.clear()
+        db1.write("stuff", {"~iteration~": [4], "B": ["y"], "D": [0.5]})
+        self.assertFalse(any(x.startswith("ALTER") and "[B]" in x for x in statements))
+        self.assertTrue(any(x.startswith("ALTER") and "[D]" in x for x in statements))
+
+        result = db1.query("SELECT * FROM stuff")
+        self.assertTrue([x["B"] for x in result] == [None, None, "x", None, "y"])
+        self.assertTrue([x["C_list"] for x in result] == [None] * 3 + [[1, 2], None])
+        self.assertTrue([x["D"] for x in result] == [None] * 4 + [0.5])
+
+        # the table is dropped and recreated elsewhere
+        db2.execute("DROP TABLE stuff")
+        db1.write("stuff", {"~iteration~": [5], "A": [3]})
+        self.assertTrue([x["A"] for x in db1.query("SELECT A FROM stuff")] == [3])
+
+    def test_select(self):
+        db = DBManager(self.db_path, is_global=True)
+        for experiment_name in ["exp0", "exp1"]:
+            db.new_experiment(experiment_name)
+            db.write(
+                "stuff",
+                {"~iteration~": list(range(10)), "A": list(range(10))},
+                experiment_name=experiment_name,
+            )
+        db.write(
+            "stuff",
+            {"~iteration~": [10, 11], "A": [None, None], "B": [1.5, 2.5]},
+            experiment_name="exp1",
+        )
+        plan = db.query(
+            "EXPLAIN QUERY PLAN SELECT * FROM stuff WHERE experiment_id=? AND [~iteration~] BETWEEN ? AND ?",
+            (1, 2, 4),
+        )
+        self.assertTrue("stuff_iteration_idx" in plan[0]["detail"])
+
+        result = db.select(
+            "stuff", ["A"], experiment_name="exp1", start_iteration=2, end_iteration=4
+        )
+        self.assertTrue([x["A"] for x in result] == [2, 3, 4])
+        self.assertTrue(all(x["experiment_name"] == "exp1" for x in result))
+
+        result = db.select("stuff", ["~iteration~", "A"], latest=True)
+        self.assertTrue([x["experiment_name"] for x in result] == ["exp0", "exp1"])
+        self.assertTrue([x["~iteration~"] for x in result] == [9, 9])
+        result = db.select("stuff", latest=True)
+        self.assertTrue([x["~iteration~"] for x in result] == [9, 11])
+        # columns are in the table's order
+        self.assertTrue(
+            list(result[0].keys()) == ["experiment_name", "~iteration~", "A", "B"]
+        )
+        result = db.select("stuff", ["B"], latest=True)
+        self.assertTrue([x["B"] for x in result] == [2.5])
+
+        with self.assertRaises(ValueError):
+            db.select("stuff", ["C"])
+
+    def test_purge_experiment(self):
+        db = DBManager(self.db_path, is_global=True)
+        for experiment_name in ["exp0", "exp1"]:
+            db.new_experiment(experiment_name)
+            for table_name in ["stuff", "other"]:
+                db.write(
+                    table_name,
+                    {"~iteration~": list(range(1000)), "A": ["x" * 100] * 1000},
+                    experiment_name=experiment_name,
+                )
+        db.write("no_experiment", {"A": [1]}, experiment_name="exp0")
+        self.assertTrue(db.purge_experiment("exp0") == 2001)
+        self.assertFalse(db.experiment_name_has_records("exp0"))
+        self.assertTrue(len(db.query("SELECT * FROM stuff")) == 1000)
+        self.assertTrue(len(db.query("SELECT * FROM no_experiment")) == 0)
+
+        size = os.path.getsize(self.db_path)
+        result = db.compact()
+        self.assertTrue(result["bytes_reclaimed"] > 0)
+        self.assertTrue(os.path.getsize(self.db_path) < size)
+        self.assertTrue(db.query("PRAGMA auto_vacuum")[0][0] == 2)
+        self.assertTrue(len(db.query("SELECT * FROM sqlite_stat1")) > 0)
+
+        # rows left behind by deleting only the experiment_ids row
+        db.delete_experiment("exp1")
+        self.assertTrue(db.purge_orphans() == 2000)
+        self.assertTrue(db.compact()["bytes_reclaimed"] > 0)
+        self.assertTrue(len(db.query("SELECT * FROM stuff")) == 0)
+
+
+def wrap_connect(connect, statements):
+    def wrapped():
+        conn = connect()
+        conn.set_trace_callback(
+            lambda x: (
+                None if x.startswith(("BEGIN", "COMMIT")) else statements.append(x)
+            )
+        )
+        return conn
+
+    return wrapped
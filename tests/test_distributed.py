@@ -0,0 +1,89 @@
+import multiprocessing
+import shutil
+import unittest
+
+import torch
+
+from record_keeper import RecordKeeper, RecordWriter
+from record_keeper.distributed import Reducer, WriterProcess
+
+FOLDER = "test_folder_distributed"
+
+
+def run_rank(record_writer, rank):
+    record_keeper = RecordKeeper(record_writer=record_writer)
+    for i in range(10):
+        record = {"loss": torch.tensor(float(rank + i)), "name": "hello"}
+        if not (rank == 2 and i in [5, 9]):
+            record["count"] = rank
+        record_keeper.update_records(record, i, parent_name="stuff")
+        if i % 4 == 3:
+            record_keeper.save_records()
+    record_keeper.save_records()
+
+
+class TestDistributed(unittest.TestCase):
+    def tearDown(self):
+        shutil.rmtree(FOLDER, ignore_errors=True)
+
+    def test_writer_process(self):
+        world_size = 3
+        writer_process = WriterProcess(
+            world_size=world_size, reduction=["mean", "per_rank"], folder=FOLDER
+        )
+        processes = [
+            multiprocessing.Process(
+                target=run_rank, args=(writer_process.get_writer(rank), rank)
+            )
+            for rank in range(world_size)
+        ]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+            self.assertTrue(p.exitcode == 0)
+        writer_process.close()
+
+        record_writer = RecordWriter(folder=FOLDER)
+        # one row per iteration
+        result = record_writer.query("SELECT * FROM stuff", return_dict=True)
+        self.assertTrue(result["~iteration~"] == list(range(10)))
+        self.assertTrue(result["loss"] == [i + 1.0 for i in range(10)])
+        self.assertTrue(result["loss_rank2"] == [i + 2.0 for i in range(10)])
+        self.assertTrue(result["name"] == ["hello"] * 10)
+        # rank 2 never logged count at iterations 5 and 9,
+        # so they're reduced without it
+        self.assertTrue(result["count"] == [1.0] * 5 + [0.5] + [1.0] * 3 + [0.5])
+
+    def test_no_reduction(self):
+        for world_size in [2, None]:
+            writer_process = WriterProcess(world_size=world_size, folder=FOLDER)
+            for rank in range(2):
+                record_writer = writer_process.get_writer(rank)
+                for i in range(3):
+                    record_writer.append("stuff", "A", rank * 100 + i, i)
+                record_writer.save_records()
+            writer_process.close()
+            result = RecordWriter(folder=FOLDER).query(
+                "SELECT * FROM stuff", return_dict=True
+            )
+            # every rank's values are kept, and without world_size
+            # each message is saved as it arrives
+            for rank in range(2):
+                values = [x for x in result["A_rank%d" % rank] if x is not None]
+                self.assertTrue(values == [rank * 100 + i for i in range(3)])
+            shutil.rmtree(FOLDER)
+
+    def test_reducer(self):
+        reducer = Reducer(["sum", "max"], world_size=2)
+        self.assertTrue(reducer.add(0, "g", "A", 1, 0) == [])
+        self.assertTrue(
+            reducer.add(1, "g", "A", 3, 0)
+            == [("g", "A_sum", 4, 0), ("g", "A_max", 3, 0)]
+        )
+        reducer.add(1, "g", "A", 5, 1)
+        reducer.add(0, "g", "A", 2, 2)
+        self.assertTrue(
+            reducer.flush(2) == [("g", "A_sum", 5, 1), ("g", "A_max", 5, 1)]
+        )
+        self.assertTrue(reducer.flush() == [("g", "A_sum", 2, 2), ("g", "A_max", 2, 2)])
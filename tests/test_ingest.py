@@ -0,0 +1,124 @@
+import os
+import shutil
+import unittest
+
+from record_keeper import RecordKeeper, RecordWriter
+from record_keeper.db_utils import DBManager
+from record_keeper.ingest import find_folders, ingest, load_folder, rebuild_logs_db
+from record_keeper.sharded_db import ShardedDBManager
+from record_keeper.utils import hash_if_too_long
+
+FOLDER = "test_folder_ingest"
+
+
+def write_experiment(folder, offset):
+    with RecordWriter(folder=folder, save_lists=True) as record_writer:
+        for i in range(5):
+            record_writer.append("stuff", "A", i + offset, i)
+            record_writer.append("other", "B", i * 0.5, i)
+        record_writer.save_records()
+        # new columns, so the CSV header changes mid-file
+        for i in range(5, 10):
+            record_writer.append("stuff", "A", i + offset, i)
+            record_writer.append("stuff", "C", [i, i + 1], i)
+            if i % 2 == 0:
+                record_writer.append("stuff", "D", "hello", i)
+        record_writer.save_records()
+
+
+class TestIngest(unittest.TestCase):
+    def setUp(self):
+        self.folders = [os.path.join(FOLDER, "runs", "exp%d" % i) for i in range(2)]
+        for i, folder in enumerate(self.folders):
+            write_experiment(folder, i * 100)
+
+    def tearDown(self):
+        shutil.rmtree(FOLDER)
+
+    def check(self, db):
+        for i in range(2):
+            result = db.select("stuff", experiment_name="exp%d" % i)
+            self.assertTrue(
+                [x["A"] for x in result] == [j + i * 100 for j in range(10)]
+            )
+            self.assertTrue([x["C_list"] for x in result][5:7] == [[5, 6], [6, 7]])
+            self.assertTrue(
+                [x["D"] for x in result][5:] == [None, "hello"] * 2 + [None]
+            )
+            result = db.select("other", experiment_name="exp%d" % i)
+            self.assertTrue([x["B"] for x in result] == [j * 0.5 for j in range(5)])
+
+    def test_ingest(self):
+        self.assertTrue(find_folders(os.path.join(FOLDER, "runs")) == self.folders)
+        # one write per table, or per CSV header, even with sparse columns
+        self.assertTrue(len(load_folder(self.folders[0], "db")) == 2)
+        self.assertTrue(len(load_folder(self.folders[0], "csv")) == 3)
+        for source, max_workers in [("db", 0), ("csv", 2)]:
+            global_db_path = os.path.join(FOLDER, "global_%s.db" % source)
+            output = ingest(
+                self.folders, global_db_path, source=source, max_workers=max_workers
+            )
+            self.assertTrue(output == {"exp0": 15, "exp1": 15})
+            db = DBManager(global_db_path, is_global=True)
+            self.check(db)
+            indexes = db.query(
+                "SELECT name FROM sqlite_master WHERE type='index' AND sql IS NOT NULL"
+            )
+            self.assertTrue(
+                {x["name"] for x in indexes}
+                == {"stuff_iteration_idx", "other_iteration_idx"}
+            )
+
+        # experiments that have records are skipped unless overwrite=True
+        output = ingest(self.folders, global_db_path, max_workers=0)
+        self.assertTrue(output == {})
+        output = ingest(self.folders, global_db_path, max_workers=0, overwrite=True)
+        self.assertTrue(output == {"exp0": 15, "exp1": 15})
+        self.check(DBManager(global_db_path, is_global=True))
+
+    def test_ingest_sharded(self):
+        global_db_path = os.path.join(FOLDER, "global")
+        ingest(
+            self.folders, global_db_path, global_db_shards="experiment", max_workers=0
+        )
+        db = ShardedDBManager(global_db_path)
+        self.check(db)
+        self.assertTrue(len(db.get_all_shards()) == 2)
+        db.close()
+
+    def test_rebuild_logs_db(self):
+        filename = os.path.join(self.folders[0], "logs.db")
+        expected = DBManager(filename).select("stuff")
+        os.remove(filename)
+        self.assertTrue(rebuild_logs_db(self.folders[0]) == 15)
+        result = DBManager(filename).select("stuff")
+        self.assertTrue([dict(x) for x in result] == [dict(x) for x in expected])
+
+    def test_hashed_group_names(self):
+        folder = os.path.join(FOLDER, "runs", "hashed")
+        group = "model_" + "_".join(["submodule"] * 10) + "_Linear"
+        hashed = hash_if_too_long(group)
+        record_keeper = RecordKeeper(record_writer=RecordWriter(folder=folder))
+        for i in range(3):
+            record_keeper.append_primitive(group, "x", i, i)
+        record_keeper.save_records()
+        record_keeper.record_writer.close()
+
+        for source in ["db", "csv"]:
+            global_db_path = os.path.join(FOLDER, "global_%s.db" % source)
+            ingest([folder], global_db_path, source=source, max_workers=0)
+            db = DBManager(global_db_path, is_global=True)
+            self.assertTrue(db.get_full_name(hashed) == group)
+        global_db_path = os.path.join(FOLDER, "global")
+        ingest([folder], global_db_path, global_db_shards=2, max_workers=0)
+        db = ShardedDBManager(global_db_path)
+        self.assertTrue(db.get_full_name(hashed) == group)
+        db.close()
+
+        # from the old logs.db, or hash_map.json if it's gone
+        for remove_db in [False, True]:
+            if remove_db:
+                os.remove(os.path.join(folder, "logs.db"))
+            rebuild_logs_db(folder)
+            db = DBManager(os.path.join(folder, "logs.db"))
+            self.assertTrue(db.get_full_name(hashed) == group)
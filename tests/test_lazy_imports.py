@@ -0,0 +1,31 @@
+import os
+import subprocess
+import sys
+import unittest
+
+import record_keeper
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(record_keeper.__file__)))
+
+SCRIPT = """
+import shutil, sys, tempfile
+sys.path.insert(0, %r)
+import record_keeper
+folder = tempfile.mkdtemp()
+record_writer = record_keeper.RecordWriter(folder)
+record_keeper.RecordKeeper(record_writer=record_writer).update_records(
+    {"A": 1, "B": [1.5, 2.5]}, 0, parent_name="stuff"
+)
+record_writer.save_records()
+record_writer.query("SELECT * FROM stuff", return_dict=True)
+shutil.rmtree(folder)
+print("torch" in sys.modules, "numpy" in sys.modules)
+"""
+
+
+class TestLazyImports(unittest.TestCase):
+    def test_lazy_imports(self):
+        output = subprocess.check_output(
+            [sys.executable, "-c", SCRIPT % SRC], text=True
+        )
+        self.assertTrue(output.split() == ["False", "False"])
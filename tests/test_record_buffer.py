@@ -0,0 +1,64 @@
+import array
+import unittest
+
+import numpy as np
+
+from record_keeper.record_buffer import RecordBuffer
+
+
+class TestRecordBuffer(unittest.TestCase):
+    def test_record_buffer(self):
+        buffer = RecordBuffer()
+        for i in [0, 1, 2, 4, 3]:
+            buffer.append("A", i, i)
+            buffer.append("B", i * 0.5, i)
+            if i >= 2:
+                buffer.append("C", "hello", i)
+        buffer.append("D", 1, 0)
+        buffer.append("D", 1.5, 4)
+        buffer.append("E", 2**70, 1)
+        buffer.append("A", 100, 3)
+
+        self.assertTrue(isinstance(buffer.columns["A"].values, array.array))
+        self.assertTrue(isinstance(buffer.columns["B"].values, array.array))
+        self.assertTrue(isinstance(buffer.columns["D"].values, list))
+        self.assertTrue(len(buffer) == 5)
+        self.assertTrue(buffer["C"] == {2: "hello", 4: "hello", 3: "hello"})
+
+        result = buffer.to_dict_of_lists()
+        self.assertTrue(result["~iteration~"] == [0, 1, 2, 3, 4])
+        self.assertTrue(result["A"] == [0, 1, 2, 100, 4])
+        self.assertTrue(result["B"] == [0, 0.5, 1, 1.5, 2])
+        self.assertTrue(result["C"] == [None, None, "hello", "hello", "hello"])
+        self.assertTrue(result["D"] == [1, None, None, None, 1.5])
+        self.assertTrue(type(result["D"][0]) is int)
+        self.assertTrue(result["E"] == [None, 2**70, None, None, None])
+
+    def test_array_block(self):
+        buffer = RecordBuffer()
+        x = np.arange(3.0)
+        for i in range(5):
+            x += 1
+            buffer.append("A", x, i)
+            if i != 2:
+                buffer.append("B", np.ones((2, 2), dtype=np.int32) * i, i)
+        self.assertTrue(buffer.columns["A"].values.shape[1:] == (3,))
+        self.assertTrue(buffer.columns["B"].values.dtype == np.int32)
+
+        # a different shape, so the rows become separate arrays
+        buffer.append("B", np.ones(3), 5)
+        self.assertTrue(isinstance(buffer.columns["B"].values, list))
+        x += 1
+        buffer.append("B", x, 6)
+
+        result = buffer.to_dict_of_lists()
+        # values were copied when appended
+        self.assertTrue(
+            [y.tolist() for y in result["A"][:5]]
+            == [[i + 1.0, i + 2.0, i + 3.0] for i in range(5)]
+        )
+        self.assertTrue(result["B"][2] is None)
+        self.assertTrue(result["B"][3].tolist() == [[3, 3], [3, 3]])
+        self.assertTrue(result["B"][6].tolist() == [6, 7, 8])
+        x += 1
+        self.assertTrue(result["B"][6].tolist() == [6, 7, 8])
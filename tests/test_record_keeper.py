@@ -1,3 +1,5 @@
+import gc
+import json
 import shutil
 import unittest
 
@@ -6,6 +8,8 @@ import torch
 from torch.utils.tensorboard import SummaryWriter
 
 from record_keeper import RecordKeeper, RecordWriter
+from record_keeper.record_buffer import BLOCK
+from record_keeper.utils import hash_if_too_long
 
 FOLDER = "test_folder"
 
@@ -77,3 +81,161 @@ class TestRecordKeeper(unittest.TestCase):
         record_keeper.update_records(
             {"loss_fn": x}, 0, recursive_types=[torch.nn.Module, dict]
         )
+
+    def test_defer_tensor_conversion(self):
+        class Stuff:
+            def __init__(self, i):
+                self._record_these = ["A", "B", "C", "D", "E"]
+                self.A = torch.tensor(i * 1.5, requires_grad=True)
+                self.B = torch.tensor(i)
+                self.C = torch.arange(3) * i
+                self.D = torch.tensor([i * 0.5])
+                self.E = "hello"
+
+        results = []
+        for defer_tensor_conversion in [False, True]:
+            record_keeper = RecordKeeper(
+                record_writer=RecordWriter(folder=FOLDER, save_lists=True),
+                attributes_to_search_for=["_record_these"],
+                defer_tensor_conversion=defer_tensor_conversion,
+            )
+            for i in range(5):
+                record_keeper.update_records({"stuff": Stuff(i)}, i)
+            # multi-element tensors are kept in a 2-d block either way
+            records = record_keeper.record_writer.records["stuff_Stuff"]
+            self.assertTrue(records.columns["C"].kind is BLOCK)
+            record_keeper.save_records()
+            results.append(
+                record_keeper.query("SELECT * from stuff_Stuff", return_dict=True)
+            )
+            self.assertTrue(record_keeper.pending_tensors is None)
+            shutil.rmtree(FOLDER)
+
+        self.assertTrue(results[0] == results[1])
+        self.assertTrue(results[1]["B"] == list(range(5)))
+        self.assertTrue(results[1]["C_list"][1] == [0, 1, 2])
+        self.assertTrue(results[1]["D"] == [i * 0.5 for i in range(5)])
+
+    def test_cache_traversal(self):
+        class Inner(torch.nn.Module):
+            def __init__(self):
+                super().__init__()
+                self._record_these = ["x"]
+                self.x = 1
+
+        class Outer(torch.nn.Module):
+            def __init__(self):
+                super().__init__()
+                self._record_these = ["y"]
+                self.y = 2
+                self.inner = Inner()
+
+        outer = Outer()
+        record_keeper = RecordKeeper(
+            record_writer=RecordWriter(folder=FOLDER),
+            attributes_to_search_for=["_record_these"],
+        )
+        kwargs = {"recursive_types": [torch.nn.Module, dict]}
+        record_keeper.update_records({"model": outer}, 0, **kwargs)
+        num_plans = len(record_keeper.traversal_plans)
+        plan = record_keeper.traversal_plans[
+            (id(outer), "model", "", (torch.nn.Module, dict))
+        ]
+        record_keeper.update_records({"model": outer}, 1, **kwargs)
+        self.assertTrue(len(record_keeper.traversal_plans) == num_plans)
+        self.assertTrue(
+            record_keeper.traversal_plans[
+                (id(outer), "model", "", (torch.nn.Module, dict))
+            ]
+            is plan
+        )
+
+        # changes to _record_these and new attributes are picked up
+        outer._record_these.append("z")
+        outer.z = 3
+        outer.inner = Inner()
+        outer.inner.x = 4
+        outer.w = torch.nn.ModuleList([Inner()])
+        record_keeper.update_records({"model": outer}, 2, **kwargs)
+        record_keeper.save_records()
+
+        result = record_keeper.query("SELECT * FROM model_Outer", return_dict=True)
+        self.assertTrue(result["y"] == [2, 2, 2])
+        self.assertTrue(result["z"] == [None, None, 3])
+        result = record_keeper.query(
+            "SELECT * FROM model_Outer__modules_inner_Inner", return_dict=True
+        )
+        self.assertTrue(result["x"] == [1, 1, 4])
+        result = record_keeper.query(
+            "SELECT * FROM w__modules_0_Inner", return_dict=True
+        )
+        self.assertTrue(result["x"] == [1])
+
+        # plans are dropped with their objects
+        del outer, plan
+        gc.collect()
+        self.assertTrue(len(record_keeper.traversal_plans) < num_plans)
+        shutil.rmtree(FOLDER)
+
+    def test_cache_traversal_new_child(self):
+        class B:
+            def __init__(self):
+                self._record_these = ["x"]
+                self.x = 1
+
+        class A:
+            def __init__(self):
+                self._record_these = ["y"]
+                self.y = 2
+                self.child = None
+
+        for cache_traversal in [True, False]:
+            a = A()
+            record_keeper = RecordKeeper(
+                record_writer=RecordWriter(folder=FOLDER),
+                attributes_to_search_for=["_record_these"],
+                cache_traversal=cache_traversal,
+            )
+            record_keeper.update_records({"a": a}, 0, recursive_types=[B])
+            # reassigned from None, so the number of attributes is the same
+            a.child = B()
+            record_keeper.update_records({"a": a}, 1, recursive_types=[B])
+            record_keeper.save_records()
+            self.assertTrue(record_keeper.table_exists("a_A_child_B"))
+            shutil.rmtree(FOLDER)
+
+    def test_hashed_group_names(self):
+        record_keeper = RecordKeeper(
+            record_writer=RecordWriter(
+                folder=FOLDER, global_db_path=FOLDER + "/global.db", experiment_name="e"
+            )
+        )
+        group = "model_" + "_".join(["submodule"] * 10) + "_Linear"
+        hashed = hash_if_too_long(group)
+        self.assertTrue(hashed != group)
+        for i in range(3):
+            record_keeper.append_primitive(group, "x", i, i)
+            # built at runtime, like the names update_records makes,
+            # so it's a different object each time
+            record_keeper.append_primitive("_".join(["short", "name"]), "x", i, i)
+        self.assertTrue(record_keeper.hash_map == {hashed: group})
+        record_keeper.save_records()
+        self.assertTrue(record_keeper.new_full_names == {})
+        with open(FOLDER + "/hash_map.json") as f:
+            self.assertTrue(json.load(f) == {hashed: group})
+
+        record_writer = record_keeper.record_writer
+        for use_global_db in [False, True]:
+            self.assertTrue(record_writer.get_full_name(hashed, use_global_db) == group)
+            self.assertTrue(
+                record_writer.get_full_name("short_name", use_global_db) == "short_name"
+            )
+            # selected by either name
+            result = record_writer.select(group, use_global_db=use_global_db)
+            self.assertTrue(result["x"] == [0, 1, 2])
+        self.assertTrue(record_writer.table_exists(group))
+        self.assertTrue(hashed in record_writer.local_db.get_table_names())
+        full_names = record_writer.local_db.query("SELECT * FROM _rk_hash_map")
+        self.assertTrue([tuple(x) for x in full_names] == [(hashed, group)])
+        record_writer.close()
+        shutil.rmtree(FOLDER)
@@ -0,0 +1,323 @@
+import csv
+import glob
+import multiprocessing
+import os
+import shutil
+import unittest
+
+import numpy as np
+import torch
+
+from record_keeper import RecordWriter
+from record_keeper.utils import concatenate_arrays, get_last_csv_header
+
+FOLDER = "test_folder_record_writer"
+
+
+def append_then_die(global_db_path):
+    record_writer = RecordWriter(
+        folder=FOLDER,
+        global_db_path=global_db_path,
+        experiment_name="test",
+        spool=True,
+    )
+    for i in range(3):
+        record_writer.append("stuff", "A", i, i)
+    record_writer.save_records()
+    for i in range(3, 6):
+        record_writer.append("stuff", "A", i, i)
+        record_writer.append("stuff", "B", [i, i + 1], i)
+    os._exit(0)
+
+
+class TestRecordWriter(unittest.TestCase):
+    def tearDown(self):
+        shutil.rmtree(FOLDER)
+
+    def test_atomic_flush(self):
+        record_writer = RecordWriter(
+            folder=FOLDER,
+            global_db_path=os.path.join(FOLDER, "global.db"),
+            experiment_name="test",
+            atomic_flush=True,
+        )
+        for i in range(5):
+            record_writer.append("stuff", "A", i, i)
+            record_writer.append("other_stuff", "B", i * 2.5, i)
+
+        def fail(*args, **kwargs):
+            raise RuntimeError
+
+        set_has_records = record_writer.global_db.set_has_records
+        record_writer.global_db.set_has_records = fail
+        with self.assertRaises(RuntimeError):
+            record_writer.save_records()
+        for use_global_db in [False, True]:
+            for table_name in ["stuff", "other_stuff"]:
+                self.assertFalse(record_writer.table_exists(table_name, use_global_db))
+        self.assertTrue(len(record_writer.records) == 2)
+
+        record_writer.global_db.set_has_records = set_has_records
+        record_writer.save_records()
+        self.assertTrue(len(record_writer.records) == 0)
+        for use_global_db in [False, True]:
+            result = record_writer.query(
+                "SELECT A FROM stuff", use_global_db=use_global_db, return_dict=True
+            )
+            self.assertTrue(result["A"] == list(range(5)))
+        self.assertTrue(record_writer.global_db.experiment_name_has_records("test"))
+        self.assertTrue(os.path.isfile(os.path.join(FOLDER, "other_stuff.csv")))
+
+    def test_async_writes(self):
+        record_writer = RecordWriter(
+            folder=FOLDER, async_writes=True, persistent_connections=True
+        )
+        for i in range(10):
+            record_writer.append("stuff", "A", i, i)
+            if i % 3 == 0:
+                record_writer.save_records()
+        record_writer.flush(wait=True)
+        result = record_writer.query("SELECT A FROM stuff", return_dict=True)
+        self.assertTrue(result["A"] == list(range(10)))
+
+        write = record_writer.local_db.write
+
+        def fail(*args, **kwargs):
+            raise RuntimeError
+
+        record_writer.local_db.write = fail
+        record_writer.append("stuff", "A", 10, 10)
+        record_writer.flush(wait=False)
+        record_writer.queue.join()
+        with self.assertRaises(RuntimeError):
+            record_writer.save_records()
+
+        # the worker keeps going after an error
+        record_writer.local_db.write = write
+        record_writer.append("stuff", "A", 11, 11)
+        record_writer.close()
+        self.assertFalse(record_writer.worker.is_alive())
+        result = record_writer.query("SELECT A FROM stuff", return_dict=True)
+        self.assertTrue(result["A"] == list(range(10)) + [11])
+
+    def test_csv_append(self):
+        filename = os.path.join(FOLDER, "stuff.csv")
+        for restart in range(2):
+            record_writer = RecordWriter(folder=FOLDER, max_open_csv_files=1)
+            for i in range(restart * 6, restart * 6 + 6):
+                record_writer.append("stuff", "A", i, i)
+                if i == 6:
+                    record_writer.append("stuff", "D", 0.5, i)
+                if i % 3 == 2:
+                    record_writer.append("stuff", "B", "x" * 100, i)
+                    record_writer.append("other_stuff", "C", i, i)
+                    record_writer.save_records()
+            record_writer.close()
+            self.assertTrue(
+                get_last_csv_header(filename, block_size=16)
+                == ["~iteration~", "A", "B"]
+            )
+
+        with open(filename, "r") as f:
+            rows = list(csv.reader(f))
+        self.assertTrue(len(rows) == 12 + 3)
+        headers = [i for i, row in enumerate(rows) if row[0] == "~iteration~"]
+        self.assertTrue(headers == [0, 7, 11])
+        self.assertTrue(rows[7] == ["~iteration~", "A", "D", "B"])
+        self.assertTrue([row[0] for row in rows[12:]] == ["9", "10", "11"])
+
+    def test_query_numpy(self):
+        record_writer = RecordWriter(folder=FOLDER, save_lists=True)
+        for i in range(10):
+            record_writer.append("stuff", "A", i, i)
+            record_writer.append("stuff", "B", i * 0.5 if i != 3 else None, i)
+            if i < 5:
+                record_writer.append("stuff", "C", i, i)
+            record_writer.append("stuff", "D", "hello", i)
+            record_writer.append("stuff", "E", [i, i], i)
+        record_writer.save_records()
+
+        result = record_writer.query(
+            "SELECT * FROM stuff", return_dict=True, return_numpy=True
+        )
+        self.assertTrue(result["A"].dtype == np.int64)
+        self.assertTrue(np.array_equal(result["A"], np.arange(10)))
+        self.assertTrue(result["B"].dtype == np.float64)
+        self.assertTrue(np.isnan(result["B"][3]))
+        self.assertTrue(np.ma.isMaskedArray(result["C"]))
+        self.assertTrue(result["C"].mask.tolist() == [False] * 5 + [True] * 5)
+        self.assertTrue(result["D"].dtype == object)
+        self.assertTrue(result["E_list"][2] == [2, 2])
+
+        chunks = list(record_writer.iter_query("SELECT * FROM stuff", chunk_size=3))
+        self.assertTrue(len(chunks) == 4)
+        # each chunk is typed independently, and merged when concatenated
+        self.assertFalse(np.ma.isMaskedArray(chunks[0]["C"]))
+        for k in result.keys():
+            merged = concatenate_arrays([x[k] for x in chunks])
+            self.assertTrue(merged.dtype == result[k].dtype)
+            self.assertTrue(str(merged.tolist()) == str(result[k].tolist()))
+
+        result = record_writer.select(
+            "stuff", ["B"], end_iteration=4, return_numpy=True
+        )
+        self.assertTrue(result["~iteration~"].tolist() == list(range(5)))
+
+    def test_list_format_array(self):
+        for compress_lists in [False, True]:
+            record_writer = RecordWriter(
+                folder=FOLDER,
+                save_lists=True,
+                list_format="array",
+                compress_lists=compress_lists,
+            )
+            for i in range(10):
+                record_writer.append("stuff", "A", torch.arange(4) * i, i)
+                record_writer.append("stuff", "B", np.ones((2, 3)) * i, i)
+            record_writer.save_records()
+
+            result = record_writer.query("SELECT * FROM stuff", return_dict=True)
+            self.assertTrue(result["A_array"][3].dtype == np.int64)
+            self.assertTrue(result["A_array"][3].tolist() == [0, 3, 6, 9])
+            self.assertTrue(result["B_array"][2].shape == (2, 3))
+
+            result = record_writer.query(
+                "SELECT * FROM stuff", return_dict=True, return_numpy=True
+            )
+            self.assertTrue(result["A_array"].shape == (10, 4))
+            self.assertTrue(result["B_array"].shape == (10, 2, 3))
+            self.assertTrue(np.array_equal(result["B_array"][5], np.ones((2, 3)) * 5))
+
+            with open(os.path.join(FOLDER, "stuff.csv")) as f:
+                rows = list(csv.reader(f))
+            self.assertTrue(rows[2][1] == "[0, 1, 2, 3]")
+            shutil.rmtree(FOLDER)
+
+        # existing json columns are still written and read as lists
+        record_writer = RecordWriter(folder=FOLDER, save_lists=True)
+        record_writer.append("stuff", "A", [1, 2], 0)
+        record_writer.save_records()
+        record_writer = RecordWriter(
+            folder=FOLDER, save_lists=True, list_format="array"
+        )
+        record_writer.append("stuff", "A", [3, 4], 1)
+        record_writer.save_records()
+        result = record_writer.query("SELECT * FROM stuff", return_dict=True)
+        self.assertTrue(result["A_list"] == [[1, 2], None])
+        self.assertTrue(result["A_array"][1].tolist() == [3, 4])
+        shutil.rmtree(FOLDER)
+
+        # arrays of python objects are saved as json
+        record_writer = RecordWriter(
+            folder=FOLDER, save_lists=True, list_format="array"
+        )
+        record_writer.append("stuff", "A", [1.0, None, 2.0], 0)
+        record_writer.append("stuff", "B", np.array([1, "a"], dtype=object), 0)
+        record_writer.save_records()
+        result = record_writer.query("SELECT * FROM stuff", return_dict=True)
+        self.assertTrue(result["A_list"] == [[1.0, None, 2.0]])
+        self.assertTrue(result["B_list"] == [[1, "a"]])
+        db = record_writer.local_db
+        db.write("stuff", {"~iteration~": [1], "C": [np.array([None, 1])]})
+        result = record_writer.query("SELECT * FROM stuff", return_dict=True)
+        self.assertTrue(result["C_list"] == [None, [None, 1]])
+
+    def test_list_format_json_arrays(self):
+        record_writer = RecordWriter(folder=FOLDER, save_lists=True)
+        x = torch.zeros(3)
+        for i in range(5):
+            x += 0.5
+            # tensors are copied when appended, so changing them later is fine
+            record_writer.append("stuff", "A", x, i)
+            record_writer.append("stuff", "B", np.arange(4) * i, i)
+            if i == 3:
+                record_writer.append("stuff", "C", np.array(["a", "b"]), i)
+                record_writer.append(
+                    "stuff", "D", torch.ones(2, dtype=torch.bfloat16), i
+                )
+        record_writer.save_records()
+
+        result = record_writer.query("SELECT * FROM stuff", return_dict=True)
+        self.assertTrue(result["A_list"][1] == [1.0, 1.0, 1.0])
+        self.assertTrue(result["B_list"][4] == [0, 4, 8, 12])
+        self.assertTrue(result["C_list"] == [None, None, None, ["a", "b"], None])
+        self.assertTrue(result["D_list"][3] == [1.0, 1.0])
+        with open(os.path.join(FOLDER, "stuff.csv")) as f:
+            rows = list(csv.reader(f))
+        self.assertTrue(rows[0] == ["~iteration~", "A", "B", "C", "D"])
+        self.assertTrue(rows[2][1:3] == ["[1.0, 1.0, 1.0]", "[0, 1, 2, 3]"])
+        self.assertTrue(rows[4][3] == "['a', 'b']")
+
+    def test_remove_lists(self):
+        record_writer = RecordWriter(folder=FOLDER)
+        for i in range(5):
+            record_writer.append("stuff", "A", i, i)
+            # starts partway through the flush
+            if i >= 2:
+                record_writer.append("stuff", "B", np.arange(3) * i, i)
+                record_writer.append("stuff", "C", [i, i], i)
+        record_writer.save_records()
+        result = record_writer.query("SELECT * FROM stuff", return_dict=True)
+        self.assertTrue(set(result) == {"id", "~iteration~", "A"})
+
+    def test_changes_since(self):
+        record_writer = RecordWriter(folder=FOLDER)
+        changes, cursor = record_writer.changes_since()
+        self.assertTrue(changes == {} and cursor == {})
+        for i in range(5):
+            record_writer.append("stuff", "A", i, i)
+            record_writer.append("other", "B", i * 0.5, i)
+        record_writer.save_records()
+
+        changes, cursor = record_writer.changes_since(limit=3)
+        self.assertTrue(changes["stuff"]["A"] == [0, 1, 2])
+        self.assertTrue(cursor == {"stuff": 3, "other": 3})
+        changes, cursor = record_writer.changes_since(cursor)
+        self.assertTrue(changes["stuff"]["A"] == [3, 4])
+        self.assertTrue(changes["other"]["B"] == [1.5, 2])
+        changes, cursor = record_writer.changes_since(cursor)
+        self.assertTrue(changes == {})
+
+        follow = record_writer.follow(cursor, interval=0.01, timeout=0.5)
+        record_writer.append("stuff", "A", 5, 5)
+        record_writer.append("new_group", "C", "hello", 5)
+        record_writer.save_records()
+        changes, cursor = next(follow)
+        self.assertTrue(changes["stuff"]["A"] == [5])
+        self.assertTrue(changes["new_group"]["C"] == ["hello"])
+        self.assertTrue(cursor == {"stuff": 6, "other": 5, "new_group": 1})
+        # nothing new, so it stops after the timeout
+        self.assertTrue(list(follow) == [])
+
+    def test_spool(self):
+        global_db_path = os.path.join(FOLDER, "global.db")
+        process = multiprocessing.Process(
+            target=append_then_die, args=(global_db_path,)
+        )
+        process.start()
+        process.join()
+        segments = glob.glob(os.path.join(FOLDER, "spool_*.bin"))
+        self.assertTrue(len(segments) == 1)
+        # a record that was being written when the process died
+        with open(segments[0], "ab") as f:
+            f.write(b"\x10\x00\x00")
+
+        record_writer = RecordWriter(
+            folder=FOLDER,
+            global_db_path=global_db_path,
+            experiment_name="test",
+            is_new_experiment=False,
+            save_lists=True,
+            spool=True,
+        )
+        self.assertTrue(glob.glob(os.path.join(FOLDER, "spool_*.bin")) == [])
+        for use_global_db in [False, True]:
+            result = record_writer.select("stuff", use_global_db=use_global_db)
+            self.assertTrue(result["A"] == list(range(6)))
+            self.assertTrue(result["B_list"][3:] == [[3, 4], [4, 5], [5, 6]])
+        with open(os.path.join(FOLDER, "stuff.csv")) as f:
+            self.assertTrue(len(list(csv.reader(f))) == 8)
+
+        record_writer.append("stuff", "A", 6, 6)
+        record_writer.close()
+        self.assertTrue(glob.glob(os.path.join(FOLDER, "spool_*.bin")) == [])
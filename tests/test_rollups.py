@@ -0,0 +1,168 @@
+import os
+import random
+import shutil
+import unittest
+
+import numpy as np
+
+from record_keeper import RecordWriter
+from record_keeper import utils as c_f
+from record_keeper.db_utils import DBManager
+
+FOLDER = "test_folder_rollups"
+
+
+def expected_buckets(values, bucket_size, start_iteration=0, end_iteration=None):
+    output = {}
+    for i, x in enumerate(values):
+        if x is None or i < start_iteration:
+            continue
+        if end_iteration is not None and i > end_iteration:
+            continue
+        output.setdefault(i // bucket_size * bucket_size, []).append(x)
+    return {
+        "~iteration~": list(output),
+        "count": [len(v) for v in output.values()],
+        "mean": [sum(v) / len(v) for v in output.values()],
+        "min": [min(v) for v in output.values()],
+        "max": [max(v) for v in output.values()],
+        "last": [v[-1] for v in output.values()],
+    }
+
+
+def is_close(x, y):
+    return x.keys() == y.keys() and all(
+        len(x[k]) == len(y[k]) and all(abs(a - b) < 1e-9 for a, b in zip(x[k], y[k]))
+        for k in x
+    )
+
+
+class TestRollups(unittest.TestCase):
+    def tearDown(self):
+        shutil.rmtree(FOLDER)
+
+    def test_rollups(self):
+        random.seed(0)
+        record_writer = RecordWriter(
+            folder=FOLDER,
+            global_db_path=os.path.join(FOLDER, "global.db"),
+            experiment_name="test",
+            rollups=[10, 50],
+            stats=True,
+        )
+        loss, accuracy = [], []
+        for i in range(237):
+            loss.append(random.random())
+            record_writer.append("stuff", "loss", loss[-1], i)
+            accuracy.append(random.randint(0, 100) if i % 3 == 0 else None)
+            if accuracy[-1] is not None:
+                record_writer.append("stuff", "accuracy", accuracy[-1], i)
+            record_writer.append("stuff", "name", "hello", i)
+            if i % 17 == 0:
+                # so buckets are split across flushes
+                record_writer.save_records()
+        record_writer.save_records()
+
+        for use_global_db in [False, True]:
+            for bucket_size, kwargs, source in [
+                (100, {}, "50"),
+                (30, {}, "10"),
+                (7, {}, "raw"),
+                (100, {"start_iteration": 10, "end_iteration": 109}, "10"),
+                (100, {"start_iteration": 5}, "raw"),
+            ]:
+                stats = record_writer.get_stats()["counters"]
+                db_name = "global_db" if use_global_db else "local_db"
+                key = "%s/select_buckets/%s" % (db_name, source)
+                count = stats.get(key, 0)
+                for name, values in [("loss", loss), ("accuracy", accuracy)]:
+                    result = record_writer.select_buckets(
+                        "stuff",
+                        name,
+                        bucket_size,
+                        use_global_db=use_global_db,
+                        **kwargs
+                    )
+                    if use_global_db:
+                        self.assertTrue(set(result.pop("experiment_name")) == {"test"})
+                    expected = expected_buckets(values, bucket_size, **kwargs)
+                    self.assertTrue(is_close(result, expected))
+                stats = record_writer.get_stats()["counters"]
+                self.assertTrue(stats[key] == count + 2)
+
+        # integers stay integers
+        result = record_writer.select_buckets("stuff", "accuracy", 50)
+        self.assertTrue(all(isinstance(x, int) for x in result["max"]))
+        # strings aren't aggregated
+        self.assertTrue(record_writer.select_buckets("stuff", "name", 50) == {})
+        # rollup tables aren't groups
+        self.assertTrue(record_writer.global_db.get_table_names() == ["stuff"])
+        changes, _ = record_writer.changes_since()
+        self.assertTrue(list(changes) == ["stuff"])
+
+        record_writer.global_db.purge_experiment("test")
+        result = record_writer.global_db.query("SELECT * FROM _rk_rollup_50")
+        self.assertTrue(len(result) == 0)
+        record_writer.close()
+
+    def test_rollup_coverage(self):
+        global_db_path = os.path.join(FOLDER, "global.db")
+        # A has rollups, B doesn't, and C's logs.db has rows from before
+        # rollups were enabled
+        for experiment_name, rollups in [("A", [10]), ("B", None), ("C", None)]:
+            with RecordWriter(
+                folder=os.path.join(FOLDER, experiment_name),
+                global_db_path=global_db_path,
+                experiment_name=experiment_name,
+                rollups=rollups,
+            ) as record_writer:
+                for i in range(100):
+                    record_writer.append("stuff", "loss", i, i)
+        with RecordWriter(
+            folder=os.path.join(FOLDER, "C"), rollups=[10]
+        ) as record_writer:
+            for i in range(100, 200):
+                record_writer.append("stuff", "loss", i, i)
+
+        values = list(range(100))
+        db = DBManager(global_db_path, is_global=True)
+        for experiment_name in ["A", "B"]:
+            result = c_f.rows_to_dict(
+                db.select_buckets("stuff", "loss", 10, experiment_name=experiment_name)
+            )
+            self.assertTrue(set(result.pop("experiment_name")) == {experiment_name})
+            self.assertTrue(is_close(result, expected_buckets(values, 10)))
+        result = db.select_buckets("stuff", "loss", 10)
+        self.assertTrue(len(result) == 30)
+
+        db = DBManager(os.path.join(FOLDER, "C", "logs.db"), stats=True)
+        values = list(range(200))
+        for kwargs, source in [({}, "raw"), ({"start_iteration": 100}, "10")]:
+            result = c_f.rows_to_dict(db.select_buckets("stuff", "loss", 10, **kwargs))
+            self.assertTrue(is_close(result, expected_buckets(values, 10, **kwargs)))
+            self.assertTrue(db.stats.counters["db/select_buckets/%s" % source] == 1)
+
+        # a writer without rollups makes them incomplete
+        with RecordWriter(folder=os.path.join(FOLDER, "C")) as record_writer:
+            record_writer.append("stuff", "loss", 200, 200)
+        self.assertTrue(
+            db.get_covering_rollup_sizes("stuff", start_iteration=100) == []
+        )
+
+    def test_rollups_with_arrays(self):
+        record_writer = RecordWriter(
+            folder=FOLDER, save_lists=True, list_format="array", rollups=[10]
+        )
+        for i in range(20):
+            record_writer.append("stuff", "loss", float(i), i)
+            record_writer.append("stuff", "embedding", np.ones(3) * i, i)
+            # a number, then arrays
+            record_writer.append("stuff", "mixed", i if i == 0 else np.ones(3), i)
+        record_writer.save_records()
+        result = record_writer.select_buckets("stuff", "loss", 10)
+        self.assertTrue(result["mean"] == [4.5, 14.5])
+        result = record_writer.select_buckets("stuff", "mixed", 10)
+        self.assertTrue(result["count"] == [1])
+        for name in ["embedding", "embedding_array"]:
+            self.assertTrue(record_writer.select_buckets("stuff", name, 10) == {})
+        record_writer.close()
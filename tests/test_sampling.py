@@ -0,0 +1,54 @@
+import shutil
+import unittest
+
+import numpy as np
+import torch
+
+from record_keeper import RecordKeeper, RecordWriter
+from record_keeper.sampling import EveryN, Reservoir, WindowReduce
+
+FOLDER = "test_folder_sampling"
+
+
+class TestSampling(unittest.TestCase):
+    def test_sampling_policies(self):
+        record_keeper = RecordKeeper(
+            record_writer=RecordWriter(folder=FOLDER),
+            sampling_policies={
+                "stuff/A": EveryN(10),
+                "stuff/B*": WindowReduce(10, ["min", "max", "mean"]),
+                "other_stuff/*": Reservoir(10, 2, seed=0),
+            },
+        )
+        for i in range(25):
+            record_keeper.update_records(
+                {"A": i, "B": float(i), "C": i}, i, parent_name="stuff"
+            )
+            record_keeper.update_records({"D": i}, i, parent_name="other_stuff")
+        record_keeper.flush_sampling_policies()
+        record_keeper.save_records()
+
+        result = record_keeper.query("SELECT * FROM stuff", return_dict=True)
+        self.assertTrue(len(result["~iteration~"]) == 25)
+        self.assertTrue(result["C"] == list(range(25)))
+        self.assertTrue([x for x in result["A"] if x is not None] == [0, 10, 20])
+        self.assertTrue([x for x in result["B_min"] if x is not None] == [0, 10, 20])
+        self.assertTrue([x for x in result["B_max"] if x is not None] == [9, 19, 24])
+        self.assertTrue(
+            [x for x in result["B_mean"] if x is not None] == [4.5, 14.5, 22]
+        )
+        self.assertTrue("B" not in result)
+
+        result = record_keeper.query("SELECT * FROM other_stuff", return_dict=True)
+        windows = [x // 10 for x in result["~iteration~"]]
+        self.assertTrue(windows == [0, 0, 1, 1, 2, 2])
+        self.assertTrue(result["D"] == result["~iteration~"])
+        shutil.rmtree(FOLDER)
+
+    def test_window_reduce_lists(self):
+        policy = WindowReduce(2)
+        for value in [[1.0, 5.0], np.array([1.0, 5.0]), torch.tensor([1.0, 5.0])]:
+            output = policy.add(value, 0)
+            self.assertTrue(len(output) == 1 and output[0][1] is value)
+        self.assertTrue(policy.add(torch.tensor(1.0), 1) == [])
+        self.assertTrue(policy.add([3], 2) == [("", 2.0, 2)])
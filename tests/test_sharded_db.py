@@ -0,0 +1,135 @@
+import os
+import shutil
+import unittest
+
+from record_keeper import RecordWriter
+from record_keeper.db_utils import DBManager
+
+FOLDER = "test_folder_sharded_db"
+
+
+class TestShardedDBManager(unittest.TestCase):
+    def tearDown(self):
+        shutil.rmtree(FOLDER)
+
+    def write_experiments(self, global_db_shards, global_db_path):
+        for i, experiment_name in enumerate(["exp0", "exp1", "exp2"]):
+            record_writer = RecordWriter(
+                folder=os.path.join(FOLDER, experiment_name),
+                global_db_path=global_db_path,
+                experiment_name=experiment_name,
+                global_db_shards=global_db_shards,
+                atomic_flush=i == 0,
+            )
+            for j in range(5):
+                record_writer.append("stuff", "A", i * 10 + j, j)
+                if i != 1:
+                    record_writer.append("stuff", "B", "hello", j)
+                    record_writer.append("other", "C", j, j)
+            record_writer.save_records()
+        return record_writer
+
+    def test_sharded_global_db(self):
+        global_db_path = os.path.join(FOLDER, "global")
+        record_writer = self.write_experiments("experiment", global_db_path)
+        self.assertTrue(
+            sorted(os.listdir(global_db_path))
+            == ["catalog.db"] + ["experiment_%d.db" % i for i in range(1, 4)]
+        )
+        global_db = record_writer.global_db
+        self.assertTrue(global_db.experiment_name_has_records("exp1"))
+        self.assertTrue(global_db.get_experiment_id("exp2") == 3)
+        self.assertTrue(global_db.table_exists("other"))
+        self.assertTrue(sorted(global_db.get_table_names()) == ["other", "stuff"])
+
+        # each shard is an ordinary global database
+        shard = DBManager(os.path.join(global_db_path, "experiment_3.db"), True)
+        self.assertTrue(shard.get_experiment_id("exp2") == 3)
+
+        result = record_writer.query(
+            "SELECT * FROM stuff", use_global_db=True, return_dict=True
+        )
+        self.assertTrue(
+            result["A"] == list(range(5)) + list(range(10, 15)) + list(range(20, 25))
+        )
+        self.assertTrue(result["B"] == ["hello"] * 5 + [None] * 5 + ["hello"] * 5)
+        result = record_writer.query(
+            "SELECT C FROM other", use_global_db=True, return_numpy=True
+        )
+        self.assertTrue(result["C"].tolist() == list(range(5)) * 2)
+
+        result = record_writer.select("stuff", ["B"], latest=True, use_global_db=True)
+        self.assertTrue(result["experiment_name"] == ["exp0", "exp2"])
+        result = record_writer.select(
+            "stuff", ["A", "B"], start_iteration=3, use_global_db=True
+        )
+        self.assertTrue(result["A"] == [3, 4, 13, 14, 23, 24])
+        self.assertTrue(result["B"] == ["hello", "hello", None, None, "hello", "hello"])
+        result = record_writer.select(
+            "stuff", experiment_name="exp1", use_global_db=True, return_numpy=True
+        )
+        self.assertTrue(result["A"].tolist() == list(range(10, 15)))
+
+        with self.assertRaises(ValueError):
+            record_writer.select("stuff", ["D"], use_global_db=True)
+        with self.assertRaises(ValueError):
+            record_writer.select("missing", use_global_db=True)
+
+    def test_changes_since(self):
+        global_db_path = os.path.join(FOLDER, "global")
+        record_writer = self.write_experiments("experiment", global_db_path)
+        changes, cursor = record_writer.changes_since(use_global_db=True)
+        self.assertTrue(
+            changes["stuff"]["A"]
+            == list(range(5)) + list(range(10, 15)) + list(range(20, 25))
+        )
+        self.assertTrue(changes["other"]["C"] == list(range(5)) * 2)
+        # ids are per shard
+        self.assertTrue(
+            cursor
+            == {
+                "experiment_1": {"stuff": 5, "other": 5},
+                "experiment_2": {"stuff": 5},
+                "experiment_3": {"stuff": 5, "other": 5},
+            }
+        )
+
+        follow = record_writer.follow(
+            cursor, use_global_db=True, interval=0.01, timeout=0.5
+        )
+        record_writer.append("stuff", "A", 25, 5)
+        record_writer.save_records()
+        changes, cursor = next(follow)
+        self.assertTrue(changes["stuff"]["A"] == [25])
+        self.assertTrue(changes["stuff"]["experiment_id"] == [3])
+        self.assertTrue(cursor["experiment_3"] == {"stuff": 6, "other": 5})
+        self.assertTrue(list(follow) == [])
+
+    def test_hashed_shards(self):
+        global_db_path = os.path.join(FOLDER, "global")
+        record_writer = self.write_experiments(2, global_db_path)
+        shard_files = [x for x in os.listdir(global_db_path) if x != "catalog.db"]
+        self.assertTrue(len(shard_files) <= 2)
+        result = record_writer.select("stuff", ["A"], use_global_db=True)
+        self.assertTrue(
+            sorted(result["A"])
+            == sorted(list(range(5)) + list(range(10, 15)) + list(range(20, 25)))
+        )
+
+        # a new experiment with the same name replaces one without records
+        record_writer.global_db.new_experiment("exp3")
+        record_writer.global_db.new_experiment("exp3")
+        self.assertFalse(record_writer.global_db.experiment_name_has_records("exp3"))
+        self.assertTrue(record_writer.global_db.get_experiment_id("exp3") == 5)
+
+    def test_purge_experiment(self):
+        global_db_path = os.path.join(FOLDER, "global")
+        record_writer = self.write_experiments("experiment", global_db_path)
+        global_db = record_writer.global_db
+        self.assertTrue(global_db.purge_experiment("exp1") == 5)
+        self.assertFalse(
+            os.path.isfile(os.path.join(global_db_path, "experiment_2.db"))
+        )
+        result = record_writer.select("stuff", ["A"], use_global_db=True)
+        self.assertTrue(result["A"] == list(range(5)) + list(range(20, 25)))
+        self.assertTrue(global_db.compact()["bytes_before"] > 0)
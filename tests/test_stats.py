@@ -0,0 +1,75 @@
+import shutil
+import unittest
+
+import torch
+
+from record_keeper import RecordKeeper, RecordWriter
+from record_keeper.stats import Histogram, NullStats, Stats
+
+FOLDER = "test_folder_stats"
+
+
+class TestStats(unittest.TestCase):
+    def tearDown(self):
+        shutil.rmtree(FOLDER, ignore_errors=True)
+
+    def test_stats(self):
+        stats = Stats()
+        record_writer = RecordWriter(folder=FOLDER, atomic_flush=True, stats=stats)
+        record_keeper = RecordKeeper(
+            record_writer=record_writer,
+            attributes_to_search_for=["_record_these"],
+            defer_tensor_conversion=True,
+            stats=stats,
+        )
+        for i in range(10):
+            record = {"A": torch.tensor(i), "B": i * 0.5}
+            if i >= 5:
+                record["C"] = "hello"
+            record_keeper.update_records(record, i, parent_name="stuff")
+            if i % 5 == 4:
+                record_keeper.save_records()
+
+        result = record_keeper.get_stats()
+        counters, timers = result["counters"], result["timers"]
+        self.assertTrue(counters["rows/stuff"] == 10)
+        self.assertTrue(counters["local_db/rows"] == 10)
+        self.assertTrue(counters["local_db/create_table"] == 1)
+        self.assertTrue(counters["local_db/alter_table"] == 1)
+        self.assertTrue(counters["tensors_converted"] == 10)
+        self.assertTrue(counters["csv_bytes/stuff"] > 0)
+        self.assertTrue(timers["update_records"]["count"] == 10)
+        self.assertTrue(timers["tensor_conversion"]["count"] == 10)
+        for k in ["save_records", "csv_write", "db_write", "local_db/lock_wait"]:
+            self.assertTrue(timers[k]["count"] == 2)
+        self.assertTrue(record_writer.get_stats() == result)
+
+        record_keeper.log_stats(10)
+        record_keeper.save_records()
+        logged = record_keeper.query(
+            "SELECT * FROM record_keeper_stats", return_dict=True
+        )
+        self.assertTrue(logged["rows/stuff"] == [10])
+        self.assertTrue(logged["update_records/count"] == [10])
+
+        stats.reset()
+        self.assertTrue(stats.to_dict() == {"counters": {}, "timers": {}})
+
+    def test_histogram(self):
+        histogram = Histogram()
+        for x in [0.001] * 98 + [0.1, 1.0]:
+            histogram.add(x)
+        result = histogram.to_dict()
+        self.assertTrue(result["count"] == 100)
+        self.assertTrue(abs(result["mean_ms"] - 11.98) < 1e-6)
+        # within a factor of two
+        self.assertTrue(1 <= result["p50_ms"] < 2)
+        self.assertTrue(100 <= result["p99_ms"] < 200)
+        self.assertTrue(result["max_ms"] == 1000)
+
+    def test_stats_off(self):
+        record_writer = RecordWriter(folder=FOLDER)
+        self.assertTrue(isinstance(record_writer.stats, NullStats))
+        record_writer.append("stuff", "A", 1, 0)
+        record_writer.save_records()
+        self.assertTrue(record_writer.get_stats() == {"counters": {}, "timers": {}})